@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+__author__ = "SILPAC H2"
+__version__ = "1.0"
+__license__ = "GPL"
+
+# Benchmarks for childes.py and pb1-parse-qualtrics.py
+# - generates synthetic CHAT and Qualtrics input (bench/synth.py)
+# - runs the TreeTagger stub (bench/tree-tagger) instead of the real tagger
+# - times the rule functions (cleanUtt, tokenise, wordPerLineChat, tagger output parsing, getTargetAS)
+#   and end-to-end runs of both scripts
+# - measures the start-up time of both scripts (--help) against a budget (--startup-budget)
+# - compares the results with a stored baseline
+#
+# Examples:
+#   bench.py --save-baseline              (before a change: store the baseline)
+#   bench.py                              (after the change: compare)
+#   bench.py --utterances 200000 --only childes
+
+import sys
+import os
+import re
+import io
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import platform
+import subprocess
+import contextlib
+import importlib.util
+
+benchDir = os.path.dirname(os.path.abspath(__file__))
+repoDir = os.path.dirname(benchDir)
+sys.path.insert(0, repoDir)    # h2tools, used by both scripts
+import synth
+
+# ----------------------------------------------------------------------
+# setup
+# ----------------------------------------------------------------------
+def loadScript(name, fileName):
+    # import a script of the repository as a module (pb1-parse-qualtrics.py has no importable name)
+    spec = importlib.util.spec_from_file_location(name, os.path.join(repoDir, fileName))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return(module)
+
+def makeWorkDir(args):
+    # temporary directory with the input files, the tagger stub and (empty) parameter files
+    workDir = tempfile.mkdtemp(prefix='h2-bench-')
+    shutil.copy(os.path.join(benchDir, 'tree-tagger'), os.path.join(workDir, 'tree-tagger'))
+    for par in ['french.par', 'italian-utf.par']:
+        open(os.path.join(workDir, par), 'w').close()
+    with open(os.path.join(workDir, 'corpus.cha'), 'w', encoding='utf8') as out:
+        out.write(synth.chatCorpus(args.utterances, args.seed))
+    with open(os.path.join(workDir, 'export.tsv'), 'w', encoding='utf8') as out:
+        out.write(synth.qualtricsExport(args.respondents, args.seed))
+    return(workDir)
+
+def runStub(workDir, text, par):
+    # tag text (one token per line) with the stub
+    return(subprocess.run(['./tree-tagger', par, '-token', '-lemma', '-sgml'], input=text.encode('utf8'),
+                          stdout=subprocess.PIPE, cwd=workDir, check=True).stdout.decode('utf8'))
+
+def chatUtterances(corpus):
+    # main lines and %mor tiers of the utterances, split like childes.py does
+    utterances = []
+    for s in corpus.split('\n*'):
+        s = re.sub(r'\n\s+', ' ', s)
+        s = re.sub(r' ?\x15.*?\x15', '', s)
+        m = re.search(r'^([A-Z]+):\s+(.*?)\n', s)
+        if m:
+            mor = re.search(r'%mor:\s+(.*)', s)
+            utterances.append((m.group(2), mor.group(1) if mor else ''))
+    return(utterances)
+
+# ----------------------------------------------------------------------
+# benchmarks
+# ----------------------------------------------------------------------
+def childesBenchmarks(workDir, args):
+    # (name, units, function) for the rule functions of childes.py
+    childes = loadScript('childes', 'childes.py')
+    with open(os.path.join(workDir, 'corpus.cha'), encoding='utf8') as f:
+        utterances = chatUtterances(f.read())
+    cleaned = [childes.cleanUtt(u) for u, mor in utterances]
+    taggerInput = ''.join('<s_b_u%d> %s\n' % (i, childes.tokenise(c)) for i, c in enumerate(cleaned))
+    tagged = runStub(workDir, re.sub(r' +', '\n', taggerInput), 'french.par')
+    # utterances as returned by readChat
+    childData = {'CHI': ('Anne_Yor', '2;01.00', 760)}
+    parsed = [{'sNr': 1, 'uttID': 'b_u1', 'speaker': 'CHI', 'child': 'Anne_Yor', 'childData': childData,
+               'timeCode': '', 'utt': u, 'mor': mor, 'splitUtt': c} for (u, mor), c in zip(utterances, cleaned)]
+
+    def wordPerLine():
+        for u in parsed:
+            childes.wordPerLineChat(u)
+
+    n = len(utterances)
+    return([
+        ('childes.cleanUtt', n, lambda: [childes.cleanUtt(u) for u, mor in utterances]),
+        ('childes.tokenise', n, lambda: [childes.tokenise(c) for c in cleaned]),
+        ('childes.wordPerLineChat', n, wordPerLine),
+        ('childes.parseTaggerOutput', n, lambda: childes.parseTaggerOutput(tagged)),
+        ])
+
+def qualtricsBenchmarks(workDir, args):
+    # (name, units, function) for the rule functions of pb1-parse-qualtrics.py
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            pb1 = loadScript('pb1', 'pb1-parse-qualtrics.py')
+            pb1.setExperiment(pb1.defaultVerbOrder)
+    except ImportError as e:
+        print("skipping pb1-parse-qualtrics.py benchmarks:", e)
+        return([])
+    import random
+    rnd = random.Random(args.seed)
+    items = [synth.italianTarget(rnd, synth.verbOrder[i % len(synth.verbOrder)]) for i in range(36 * args.respondents)]
+    sentences = sorted(set(pb1.normaliseItem(i) for i in items))
+    taggerInput = ''.join(' <s_S%d> %s' % (i + 1, s) for i, s in enumerate(sentences))
+    # tokenisation of treeTagger()
+    taggerInput = re.sub(r'([\'\´\`])', r'\1 ', taggerInput)
+    taggerInput = re.sub(r'([\"\.\!,;:])', r' \1 ', taggerInput)
+    tagged = runStub(workDir, re.sub(r' +', '\n', taggerInput), 'italian-utf.par')
+    (itemWords, itemPOS, itemTagged) = pb1.parseTaggerOutput(tagged)
+    keys = list(itemTagged.keys())
+    return([
+        ('pb1.normaliseItem', len(items), lambda: [pb1.normaliseItem(i) for i in items]),
+        ('pb1.parseTaggerOutput', len(sentences), lambda: pb1.parseTaggerOutput(tagged)),
+        ('pb1.getTargetAS', len(keys), lambda: [pb1.getTargetAS(itemPOS[k], itemTagged[k]) for k in keys]),
+        ])
+
+def endToEndBenchmarks(workDir, args):
+    # (name, units, function) for complete runs of the scripts with the stub tagger
+    env = dict(os.environ, HOME=workDir)    # pb1-parse-qualtrics.py looks for the tagger in ~/Nextcloud first
+
+    def run(*command):
+        subprocess.run([sys.executable] + list(command), cwd=workDir, env=env, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    childes = os.path.join(repoDir, 'childes.py')
+    pb1 = os.path.join(repoDir, 'pb1-parse-qualtrics.py')
+    benchmarks = [
+        ('e2e childes.py (%mor)', args.utterances, lambda: run(childes, 'corpus.cha')),
+        ('e2e childes.py -p (tagger)', args.utterances, lambda: run(childes, '-p', 'french.par', '-m', 'VER', 'corpus.cha')),
+        ]
+    if importlib.util.find_spec('pandas') is not None:
+        benchmarks.append(('e2e pb1-parse-qualtrics.py', args.respondents, lambda: run(pb1, '-o', 'items.tsv', 'export.tsv')))
+    return(benchmarks)
+
+def startupBenchmarks(workDir, args):
+    # (name, units, function) for the start-up time of the scripts: --help only imports modules and parses options
+    def run(script):
+        subprocess.run([sys.executable, os.path.join(repoDir, script), '--help'], cwd=workDir, check=True, stdout=subprocess.DEVNULL)
+
+    return([('startup ' + script, 1, lambda script=script: run(script)) for script in ['childes.py', 'pb1-parse-qualtrics.py']])
+
+def timeBest(function, repeat):
+    # best wall time of repeat runs
+    best = None
+    for r in range(repeat):
+        start = time.perf_counter()
+        function()
+        seconds = time.perf_counter() - start
+        if best is None or seconds < best:
+            best = seconds
+    return(best)
+
+# ----------------------------------------------------------------------
+# main
+# ----------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmarks for childes.py and pb1-parse-qualtrics.py on synthetic data.',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--utterances', default=20000, type=int, help='size of the synthetic CHAT corpus')
+    parser.add_argument('--respondents', default=200, type=int, help='size of the synthetic Qualtrics export')
+    parser.add_argument('--seed', default=1, type=int, help='random seed for the synthetic data')
+    parser.add_argument('--repeat', default=3, type=int, help='report the best of this many runs')
+    parser.add_argument('--only', default='', type=str, help='run only benchmarks whose name matches this regex')
+    parser.add_argument('--baseline', default=os.path.join(benchDir, 'baseline.json'), type=str, help='baseline file')
+    parser.add_argument('--save-baseline', action='store_true', help='store the results as the new baseline')
+    parser.add_argument('--tolerance', default=0.15, type=float, help='report changes larger than this fraction')
+    parser.add_argument('--json', default='', type=str, help='write the results to this JSON file')
+    parser.add_argument('--startup-budget', default=0.15, type=float, help='maximum start-up time of a script in seconds')
+    args = parser.parse_args()
+
+    sys.stderr.write("Generating synthetic data: %d utterances, %d respondents\n" % (args.utterances, args.respondents))
+    workDir = makeWorkDir(args)
+    try:
+        benchmarks = (startupBenchmarks(workDir, args) + childesBenchmarks(workDir, args) + qualtricsBenchmarks(workDir, args)
+                      + endToEndBenchmarks(workDir, args))
+        results = {}
+        for (name, units, function) in benchmarks:
+            if args.only and not re.search(args.only, name):
+                continue
+            seconds = timeBest(function, args.repeat)
+            results[name] = {'seconds': round(seconds, 4), 'units': units, 'per_second': round(units / seconds, 1)}
+    finally:
+        shutil.rmtree(workDir)
+
+    run = {'sizes': {'utterances': args.utterances, 'respondents': args.respondents, 'seed': args.seed},
+           'python': platform.python_version(), 'machine': platform.node(), 'results': results}
+    baseline = None
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['sizes'] != run['sizes']:
+            print("WARNING: baseline was measured with other sizes:", baseline['sizes'])
+    # report
+    regressions = 0
+    print("%-32s %10s %14s %10s %9s" % ('benchmark', 'seconds', 'units/s', 'baseline', 'change'))
+    for name, r in results.items():
+        line = "%-32s %10.4f %14.1f" % (name, r['seconds'], r['per_second'])
+        if baseline is not None and name in baseline['results']:
+            base = baseline['results'][name]['seconds']
+            change = r['seconds'] / base - 1
+            line += " %10.4f %+8.1f%%" % (base, 100 * change)
+            if change > args.tolerance:
+                line += "  SLOWER"
+                regressions += 1
+            elif change < -args.tolerance:
+                line += "  faster"
+        if name.startswith('startup') and r['seconds'] > args.startup_budget:
+            line += "  OVER BUDGET (%.2f s)" % args.startup_budget
+            regressions += 1
+        print(line)
+    if args.json != '':
+        with open(args.json, 'w') as out:
+            json.dump(run, out, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as out:
+            json.dump(run, out, indent=2)
+            out.write('\n')
+        print("Baseline saved:", args.baseline)
+    elif baseline is None:
+        print("No baseline found (%s). Store one with --save-baseline." % args.baseline)
+    return(1 if regressions else 0)
+
+if __name__ == "__main__":
+    sys.exit(main())
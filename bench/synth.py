@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+__author__ = "SILPAC H2"
+__version__ = "1.0"
+__license__ = "GPL"
+
+# Synthetic input data for the benchmarks (bench/bench.py)
+# - CHAT corpora like the concatenated French CHILDES projects (input of childes.py)
+# - Qualtrics exports like the Italian priming experiments (input of pb1-parse-qualtrics.py)
+# The data are random but reproducible (same size and seed = same file).
+#
+# Examples:
+#   synth.py chat 100000 corpus.cha          (100000 utterances)
+#   synth.py qualtrics 500 export.tsv        (500 respondents)
+
+import argparse
+import random
+
+# ----------------------------------------------------------------------
+# CHAT
+# ----------------------------------------------------------------------
+children = [('Anne', 'York'), ('Tim', 'Paris'), ('Julie', 'Paris'), ('Léa', 'Lyon'), ('Marie', 'Geneva'), ('Theo', 'York')]
+speakers = [('CHI', 0.55), ('MOT', 0.3), ('FAT', 0.1), ('INV', 0.05)]
+# French utterances: (word, %mor annotation)
+subjects = [('je', 'pro|je'), ('tu', 'pro|tu'), ('il', 'pro|il'), ('elle', 'pro|elle'), ('on', 'pro|on'), ('maman', 'n|maman'), ('le chat', 'det|le n|chat')]
+verbs = [('mange', 'v|manger-PRES'), ('donne', 'v|donner-PRES'), ('tombe', 'v|tomber-PRES'), ('casse', 'v|casser-PRES'),
+         ('ouvre', 'v|ouvrir-PRES'), ('joue', 'v|jouer-PRES'), ('va', 'v|aller-PRES'), ('est', 'v|être-PRES'), ('a', 'v|avoir-PRES')]
+objects = [('la pomme', 'det|la n|pomme'), ('le ballon', 'det|le n|ballon'), ('à maman', 'prep|à n|maman'), ('ça', 'pro|ça'),
+           ('les cubes', 'det|les n|cube-PL'), ('au parc', 'prep|au n|parc'), ('dehors', 'adv|dehors'), ('lui', 'pro|lui')]
+fillers = [('oui', 'co|oui'), ('non', 'co|non'), ('regarde', 'v|regarder-IMP'), ('encore', 'adv|encore')]
+
+def chatUtterance(rnd):
+    # one utterance: main line, %mor tier (or None), other tiers
+    words = []
+    mor = []
+    if rnd.random() < 0.15:
+        (w, m) = rnd.choice(fillers)
+        words.append(w)
+        mor.append(m)
+    for part in (subjects, verbs, objects):
+        (w, m) = rnd.choice(part)
+        words.append(w)
+        mor.append(m)
+    if rnd.random() < 0.3:    # longer utterances
+        for part in (verbs, objects):
+            (w, m) = rnd.choice(part)
+            words.append(w)
+            mor.append(m)
+    words.append(rnd.choice(['.', '.', '.', '?', '!']))
+    mor.append(words[-1])
+    utt = ' '.join(words)
+    # CHAT annotation handled by cleanUtt
+    r = rnd.random()
+    if r < 0.08:
+        utt = '<' + ' '.join(words[:2]) + '> [/] ' + utt    # repetition
+    elif r < 0.14:
+        utt = 'xxx ' + utt    # incomprehensible
+    elif r < 0.18:
+        utt = utt.replace(' ', ' [!] ', 1)
+    elif r < 0.21:
+        utt = '+< ' + utt
+    elif r < 0.24:
+        utt = utt.replace(words[0], words[0] + '@s', 1)
+    elif r < 0.27:
+        utt = utt.replace('e ', '(e) ', 1)
+    return(utt, ' '.join(mor) if rnd.random() < 0.7 else None)
+
+def chatCorpus(nUtterances, seed=1, perFile=500):
+    # concatenated CHAT files with nUtterances utterances in total
+    rnd = random.Random(seed)
+    out = []
+    nFiles = max(1, nUtterances // perFile)
+    for f in range(nFiles):
+        (child, project) = children[f % len(children)]
+        months = 18 + (f * 30) // nFiles
+        age = '%d;%02d.%02d' % (months // 12, months % 12, rnd.randint(0, 29))
+        out.append('@UTF8\n')
+        out.append('@PID:\t11312/c-%08d-1\n' % (f + 1))
+        out.append('@Begin\n@Languages:\tfra\n')
+        out.append('@Participants:\tCHI %s Target_Child , MOT Mother Mother , FAT Father Father , INV Investigator Investigator\n' % child)
+        out.append('@ID:\tfra|%s|CHI|%s|female|||Target_Child|||\n' % (project, age))
+        out.append('@ID:\tfra|%s|MOT|||||Mother|||\n' % project)
+        out.append('@ID:\tfra|%s|FAT|||||Father|||\n' % project)
+        out.append('@Media:\t%s%02d, audio\n' % (child.lower(), f))
+        time = 0
+        n = perFile if f < nFiles - 1 else nUtterances - perFile * (nFiles - 1)
+        for u in range(n):
+            speaker = rnd.choices([s for s, w in speakers], weights=[w for s, w in speakers])[0]
+            (utt, mor) = chatUtterance(rnd)
+            cut = utt.find(' ', 30)
+            if cut > 0 and rnd.random() < 0.5:    # multi-line utterance
+                utt = utt[:cut] + '\n\t' + utt[cut + 1:]
+            start = time
+            time += rnd.randint(800, 4000)
+            out.append('*%s:\t%s \x15%d_%d\x15\n' % (speaker, utt, start, time))
+            if mor is not None:
+                out.append('%%mor:\t%s\n' % mor)
+            if rnd.random() < 0.1:
+                out.append('%act:\tpoints to the toy\n')
+            if rnd.random() < 0.05:
+                out.append('%com:\tlaughs\n')
+        out.append('@End\n')
+    return(''.join(out))
+
+# ----------------------------------------------------------------------
+# Qualtrics
+# ----------------------------------------------------------------------
+# target verb order of Exp #2 (three items per verb)
+verbOrder = ['fermare', 'affondare', 'rompere', 'curare', 'bruciare', 'bollire', 'bagnare', 'sciogliere', 'illuminare', 'aprire', 'diminuire', 'aumentare']
+# verb : (3sg present, past participle, subjects/objects)
+italian = {
+    'fermare': ('ferma', 'fermato', ['la macchina', 'il treno', 'la palla']),
+    'affondare': ('affonda', 'affondato', ['la nave', 'la barca', 'il sasso']),
+    'rompere': ('rompe', 'rotto', ['il vaso', 'il bicchiere', 'la finestra']),
+    'curare': ('cura', 'curato', ['il cane', 'il gatto', 'la ferita']),
+    'bruciare': ('brucia', 'bruciato', ['la carta', 'il legno', 'la torta']),
+    'bollire': ('bolle', 'bollito', ["l'acqua", 'la pasta', 'il latte']),
+    'bagnare': ('bagna', 'bagnato', ['il prato', 'la maglia', 'il tappeto']),
+    'sciogliere': ('scioglie', 'sciolto', ['il ghiaccio', 'la neve', 'il burro']),
+    'illuminare': ('illumina', 'illuminato', ['la stanza', 'la strada', 'il palco']),
+    'aprire': ('apre', 'aperto', ['la porta', 'la scatola', 'il cancello']),
+    'diminuire': ('diminuisce', 'diminuito', ['il prezzo', 'la febbre', 'il rumore']),
+    'aumentare': ('aumenta', 'aumentato', ['il prezzo', 'la temperatura', 'il volume']),
+    }
+agents = ['il ragazzo', 'la donna', 'il veterinario', 'il sole', 'il cuoco', 'la bambina']
+
+def italianTarget(rnd, verb):
+    # a typed target sentence: transitive, unaccusative, reflexive or passive, with typing variation
+    (pres, pper, themes) = italian[verb]
+    theme = rnd.choice(themes)
+    agent = rnd.choice(agents)
+    r = rnd.random()
+    if r < 0.35:
+        s = agent + ' ' + pres + ' ' + theme
+    elif r < 0.6:
+        s = theme + ' si ' + pres
+    elif r < 0.8:
+        s = theme + ' ' + pres
+    elif r < 0.9:
+        s = theme + ' è stato ' + pper + ' da ' + agent
+    else:
+        s = theme + ' ' + pres + ' sotto il sole'
+    s = s[0].upper() + s[1:]
+    r = rnd.random()
+    if r < 0.3:
+        s += '.'
+    elif r < 0.35:
+        s = s.replace(' ', '  ', 1)    # typing variation, removed by normaliseItem
+    elif r < 0.4:
+        s = ' ' + s + ' '
+    return(s)
+
+def qualtricsExport(nRespondents, seed=1, nLists=3):
+    # tab-delimited export: header row, row with question texts, one row per respondent
+    rnd = random.Random(seed)
+    nItems = 3 * len(verbOrder)
+    quest = ['StartDate', 'EndDate', 'Status', 'Progress', 'Duration (in seconds)', 'Finished', 'RecordedDate', 'ResponseId',
+             'LocationLatitude', 'LocationLongitude', 'DistributionChannel', 'UserLanguage', 'Age', 'Gender', 'Languages_1', 'End of questionnaire']
+    header = list(quest)
+    questions = list(quest)
+    for l in range(1, nLists + 1):
+        for i in range(1, nItems + 1):
+            code = 'ABC'[l - 1] + '_Pri_Tar_' + str(i)
+            header += ['%d_Prime-List%d' % (100 * l + i, l), '%d_Target-List%d' % (100 * l + i, l)]
+            questions += [code + '=prime', code + '=target']
+    header += ['Argument_structure_prime', 'Content_prime', 'Animacy_prime']
+    questions += ['Argument_structure_prime', 'Content_prime', 'Animacy_prime']
+    lines = ['\t'.join(header), '\t'.join(questions)]
+    for r in range(nRespondents):
+        l = rnd.randint(1, nLists)
+        listID = 'ABC'[l - 1]
+        finished = 'False' if rnd.random() < 0.05 else 'True'
+        row = ['2023-06-%02d 10:00:00' % (r % 28 + 1), '2023-06-%02d 10:20:00' % (r % 28 + 1), 'IP Address', '100', str(rnd.randint(600, 1800)),
+               finished, '2023-06-%02d 10:20:01' % (r % 28 + 1), 'R_%012d' % r,
+               '%.4f' % rnd.uniform(37.0, 46.0), '%.4f' % rnd.uniform(8.0, 16.0), 'anonymous', 'IT', str(rnd.randint(18, 70)),
+               rnd.choice(['female', 'male']), 'Italian' if rnd.random() < 0.95 else 'German', '']
+        for lst in range(1, nLists + 1):
+            for i in range(1, nItems + 1):
+                if lst == l:
+                    row += ['', italianTarget(rnd, verbOrder[(i - 1) // 3])]
+                else:
+                    row += ['', '']
+        primes = [rnd.choice('TARP') for i in range(nItems)]
+        row.append('/'.join('%s_Pri_Tar_%d=%s' % (listID, i + 1, p) for i, p in enumerate(primes)) + '/')
+        row.append('/'.join('%s_Pri_Tar_%d=prime%d%s' % (listID, i + 1, i + 1, p) for i, p in enumerate(primes)) + '/')
+        row.append('/'.join('%s_Pri_Tar_%d=%s' % (listID, i + 1, rnd.choice(['anim', 'inan'])) for i in range(nItems)) + '/')
+        lines.append('\t'.join(row))
+    return('\n'.join(lines) + '\n')
+
+# ----------------------------------------------------------------------
+# main
+# ----------------------------------------------------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Write synthetic input data for the benchmarks.')
+    parser.add_argument('kind', choices=['chat', 'qualtrics'], help='type of input')
+    parser.add_argument('size', type=int, help='number of utterances (chat) or respondents (qualtrics)')
+    parser.add_argument('out_file', type=str, help='output file')
+    parser.add_argument('--seed', default=1, type=int, help='random seed')
+    args = parser.parse_args()
+    with open(args.out_file, 'w', encoding='utf8') as out:
+        if args.kind == 'chat':
+            out.write(chatCorpus(args.size, args.seed))
+        else:
+            out.write(qualtricsExport(args.size, args.seed))
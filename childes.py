@@ -7,40 +7,236 @@ __status__ = "7.10.23"
 __license__ = "GPL"
 
 import sys
-import argparse, pickle, re
+import argparse, re
 import os
-import fileinput
-import datetime
-from xmlrpc.client import boolean
-import subprocess   # for system commands, here: tree-tagger
 from collections import defaultdict   #  make dictionaries with initialised keys (avoids KeyError)
 import csv
+import contextlib
+import itertools
+import logging
+import h2tools    # shared helpers: metrics, rule tracing, tagging
+from h2tools import stage, count, setUnits, printMetrics, writeMetricsJson   # timing and counters (--profile, --metrics-json)
 
-# global vars
-age = child = speaker = utt = uttID = timeCode = splitUtt = pid = ''
-sNr = age_days = 0
-outRows = []
-childData = {}
+log = logging.getLogger('childes')
+
+# columns of the output table
+outHeader = ['utt_id', 'utt_nr', 'w_nr', 'speaker', 'child_project', 'age', 'age_days', 'time_code', 'word', 'lemma', 'pos', 'features', 'note', 'utterance', 'utt_clean', 'utt_tagged']
+# options of chatRows() and their default values (same as the command line options)
+chatDefaults = {'first_utterance': False, 'match_tagging': '', 'parameters': '', 'pos_utterance': '', 'tagger_input': False, 'tagger_output': False,
+                'sample': 0, 'sample_frac': 0.0, 'seed': 1}
+sampleAgeBin = 182   # days: the strata of a sample are child x half year of age
+sortNumeric = {'utt_nr', 'w_nr', 'age_days'}   # columns compared as numbers by sortRows()
+sortBatchSize = 10000   # utterances read (and tagged) together when the output is sorted
+sortFanIn = 64   # maximum number of runs merged at once by sortRows() (open files)
 
 def main(args):
-  global age, age_days, child, childData, speaker, utt, uttID, pid, splitUtt, sNr, timeCode, outRows    # needed to modify global vars locally
-  age = child = taggerInput = pid = ''
-  age_days = 0
-  childData = {}  # store age for a child
-  with open(args.out_file, 'r', encoding="utf8") as file:  # , newline=''
-    sys.stderr.write("Reading " + args.out_file +'\n')
-    all = file.read()
-    all = re.sub('@END', '*\n', all)  # insert delimiter at end of file
-    sentences = all.split('\n*')   # split utterances at '*', e.g. *CHI:
-  if len(sentences) <= 1:
-    sys.stderr.write("No output sentences found. " + str(len(sentences)) + " Exiting.\n")
-    sys.exit(0)
+  # command line: convert one CHAT file, write the table to <file>.csv (option -p: <file>.tagged.csv)
+  outFile = args.out_file + ('.tagged.csv' if args.parameters != '' else '.csv')
+  try:
+    # write output table: DictWriter matches header and rows, regardless of the order of fields in row
+    with open(outFile, 'w', newline='') as out:   # newline '' is needed: we have commas in items
+      writer = csv.DictWriter(out, delimiter='\t', fieldnames=outHeader)
+      writer.writeheader()
+      batches = chatRows([args.out_file], args, sortBatchSize if args.sort_by else 0)
+      if args.sort_by:
+        batches = sortRows(batches, args.sort_by, args.sort_buffer, os.path.dirname(os.path.abspath(outFile)))
+      for rows in batches:
+        with stage('write csv'):
+          writer.writerows(rows)
+  except h2tools.InputError as e:
+    sys.stderr.write('!!!!! ERROR: ' + str(e) + '\n')
+    sys.exit(1)
+  if args.parameters != '':
+    sys.stderr.write("\nOutput file: " + outFile + '\n')
+  else:
+    sys.stderr.write("output was written to: " + outFile + '\n')
+  if args.profile:
+    printMetrics()
+  if args.metrics_json != '':
+    writeMetricsJson(args.metrics_json)
+  if args.trace_rules != '':
+    h2tools.writeRuleReport(args.trace_rules)
+
+#-------------------------------------------------------
+# library functions (see also h2api.py)
+#-------------------------------------------------------
+def chatOptions(options=None):
+  # complete the options of chatRows() with the default values
+  # input:  command line options (argparse.Namespace), dictionary or None
+  # output: argparse.Namespace
+  if options is None:
+    options = {}
+  if isinstance(options, dict):
+    unknown = set(options) - set(chatDefaults)
+    if unknown:
+      raise TypeError("unknown options: " + ', '.join(sorted(unknown)))
   else:
-    sys.stderr.write("Processing " + str(len(sentences)) + ' utterances\n')
-  with open('tagthis.tmp', 'w') as tagthis:  # initialise tagger output file
-    pass
+    options = vars(options)
+  complete = dict(chatDefaults)
+  complete.update(options)
+  return(argparse.Namespace(**complete))
+
+def chatRows(fileNames, options=None, batchSize=0):
+  # convert CHAT files to one word per line tables
+  # input:  list of CHAT files, options (see chatOptions)
+  #         batchSize: number of utterances tagged and returned together (0: one batch per file)
+  # output: yields lists of rows (dictionaries, keys: outHeader)
+  options = chatOptions(options)
+  utterances = readChatFiles(fileNames)
+  if options.sample > 0 or options.sample_frac > 0:   # select the utterances before tokenising and tagging
+    utterances = h2tools.stratifiedSample(utterances, sampleStratum, options.sample, options.sample_frac, options.seed)
+  nUtt = nBatch = nTokens = 0
+  rows = []
+  taggerInput = []   # utterances tokenised for the tagger, one per line
+  fileName = None
+  for u in utterances:
+    if rows and (u['fileName'] != fileName or (batchSize > 0 and nBatch >= batchSize)):
+      nTokens += len(rows)
+      yield(tagBatch(rows, taggerInput, options))
+      rows = []
+      taggerInput = []
+      nBatch = 0
+    fileName = u['fileName']
+    nUtt += 1
+    nBatch += 1
+    # concatenate utterances to build taggerInput. Use tag with uttID
+    if options.parameters != '':
+      with stage('tokenise'):
+        taggerInput.append("<s_" + u['uttID'] + "> " + tokenise(u['splitUtt']) + '\n')
+    # split utterance into tokens: list of table rows
+    if u['speaker'] != '':
+      with stage('word per line'):
+        if options.parameters == '':
+          rows.extend(wordPerLineChat(u))
+        else:
+          rows.extend(wordPerLineTagger(u, options))
+    else:
+      count('utterances without speaker')
+  if rows:
+    nTokens += len(rows)
+    yield(tagBatch(rows, taggerInput, options))
+  setUnits('utterances', nUtt)
+  setUnits('tokens', nTokens)
+
+def sortRows(batches, sortBy, bufferSize=1000000, tmpDir=None):
+  # sort the rows of chatRows() in bounded memory (external merge sort)
+  # up to bufferSize rows are sorted in memory, larger tables are spilled to temporary files as sorted runs,
+  # which are merged at the end (in several passes if there are more than sortFanIn runs).
+  # Rows with the same key keep their input order.
+  # input:  batches of rows (see chatRows), list of columns (outHeader), maximum number of rows in memory,
+  #         directory of the temporary files (default: the system temp directory)
+  # output: yields batches of sorted rows
+  import heapq
+  import tempfile
+  key = sortKey(sortBy)
+  with tempfile.TemporaryDirectory(prefix='childes-sort-', dir=tmpDir) as runDir:
+    runs = []   # file names of the sorted runs
+    buffer = []
+    for rows in batches:
+      buffer.extend(rows)
+      while len(buffer) >= bufferSize:
+        with stage('sort'):
+          runs.append(writeRun(sorted(buffer[:bufferSize], key=key), runDir, len(runs)))
+        del buffer[:bufferSize]
+    with stage('sort'):
+      buffer.sort(key=key)
+    if not runs:
+      if buffer:
+        yield(buffer)
+      return
+    count('sort runs', len(runs) + (1 if buffer else 0))
+    nRuns = len(runs)
+    while len(runs) >= sortFanIn:   # merge passes: groups of consecutive runs (the input order of equal rows is kept)
+      merged = []
+      for i in range(0, len(runs), sortFanIn):
+        with stage('sort'), openRuns(runs[i:i+sortFanIn]) as readers:
+          merged.append(writeRun(heapq.merge(*readers, key=key), runDir, nRuns))
+        nRuns += 1
+      runs = merged
+    with openRuns(runs) as readers:
+      merged = heapq.merge(*readers, buffer, key=key)
+      while True:
+        with stage('sort'):
+          rows = list(itertools.islice(merged, bufferSize))
+        if not rows:
+          return
+        yield(rows)
+
+def writeRun(rows, runDir, runNr):
+  # write sorted rows to a temporary file (see sortRows), output: the file name
+  fileName = os.path.join(runDir, 'run%d.tsv' % runNr)
+  with open(fileName, 'w', newline='', encoding='utf8') as run:
+    csv.DictWriter(run, delimiter='\t', fieldnames=outHeader).writerows(rows)
+  return(fileName)
+
+@contextlib.contextmanager
+def openRuns(runs):
+  # read the rows of temporary files written by writeRun(), the files are deleted when they are closed
+  files = [open(run, 'r', newline='', encoding='utf8') for run in runs]
+  try:
+    yield([csv.DictReader(f, delimiter='\t', fieldnames=outHeader) for f in files])
+  finally:
+    for f in files:
+      f.close()
+      os.remove(f.name)
 
-  for s in sentences:  # sentence = utterance
+def sortKey(sortBy):
+  # key function for sortRows(): the columns in sortNumeric are compared as numbers, the others as strings
+  # rows read back from the runs contain strings only, so the values of both are converted
+  def value(v, numeric):
+    if v is None:
+      v = ''    # written as '' by csv
+    if numeric:
+      try:
+        return((0, float(v), ''))
+      except ValueError:
+        pass
+    return((1, 0, str(v)))
+  def key(row):
+    return(tuple(value(row[c], c in sortNumeric) for c in sortBy))
+  return(key)
+
+def sampleStratum(u):
+  # stratum of an utterance for options --sample, --sample-frac: child and age bin of the recording
+  return((u['child'], u['ageDays'] // sampleAgeBin))
+
+def tagBatch(rows, taggerInput, options):
+  # TreeTagger (option -p): tag the utterances of a batch and add the tagger output to its rows
+  if options.parameters != '':
+    sys.stderr.write('Running TreeTagger on taggerInput\n')
+    with stage('tagger'):
+      (itemWords, itemPOS, itemLemmas, itemTagged) = treeTagger(''.join(taggerInput), options.parameters)
+    sys.stderr.write('Adding tagger output for each utterance...\n')
+    with stage('addTagging'):
+      addTagging(rows, itemPOS, itemLemmas, itemTagged, options)
+  return(rows)
+
+def readChatFiles(fileNames):
+  # utterances of several CHAT files, numbered across the files (see readChat)
+  sNr = 0
+  for fileName in fileNames:
+    for u in readChat(fileName, sNr):
+      sNr = u['sNr']
+      yield(u)
+
+def readChat(fileName, sNr=0):
+  # read a CHAT file (or concatenated CHAT files), parse the file headers and the utterances
+  # input:  CHAT file, number of the last utterance read before (utterances are numbered across files)
+  # output: yields one dictionary per utterance: fileName, sNr, uttID, speaker, child, ageDays (of the target child),
+  #         childData, timeCode, utt, mor, splitUtt
+  age = child = pid = ''
+  age_days = 0
+  childData = {}  # store age for a child
+  sys.stderr.write("Reading " + fileName +'\n')
+  sentences = chatBlocks(fileName)
+  first = next(sentences)
+  second = next(sentences, None)
+  if second is None:
+    sys.stderr.write("No output sentences found. 1\n")
+    return
+  nSentences = 0
+  for s in itertools.chain([first, second], sentences):  # sentence = utterance
+    nSentences += 1
     # -------------------------------------------------------
     # parse file header
     # -------------------------------------------------------
@@ -48,6 +244,7 @@ def main(args):
     rePID = re.compile('@PID:.*/.*?0*(\d+)')
     if re.search(rePID, s):
       if re.search (r'@Comment:.*dummy file', s):
+        count('skipped dummy files')
         continue
       m = re.search(rePID, s)
       pid = m.group(1)
@@ -85,9 +282,7 @@ def main(args):
       sys.stderr.write("PID: %s / CHILD: %s / AGE: %s = %s days\n" % (pid, child, age, str(age_days)))
       continue  # no output for the header
     if pid == '':       # verify if header was parsed
-      sys.stderr.write('!!!!! ERROR: missing header info. Check the file header! Exiting at utterance:\n')
-      sys.stderr.write(s)
-      sys.exit(1)
+      raise h2tools.InputError('missing header info. Check the file header! Exiting at utterance:\n' + s)
     # -------------------------------------------------------
     # parse utterance
     # -------------------------------------------------------
@@ -115,52 +310,49 @@ def main(args):
       m = re.search(reMatch, s)
       speaker = m.group(1)
       utt = m.group(2)
-    splitUtt = cleanUtt(utt)  # clean copy for splitting in to words
-    # concatenate utterances to build taggerInput. Use tag with uttID
-    if args.parameters != '':
-      with open('tagthis.tmp', 'a') as tagthis:  # for tagger output
-        taggerLine = "<s_" + uttID + "> " + tokenise(splitUtt) + '\n'
-        tagthis.write(taggerLine)
+    with stage('cleanUtt'):
+      splitUtt = cleanUtt(utt)  # clean copy for splitting in to words
+    yield({'fileName': fileName, 'sNr': sNr, 'uttID': uttID, 'speaker': speaker, 'child': child, 'ageDays': age_days,
+           'childData': childData, 'timeCode': timeCode, 'utt': utt, 'mor': mor, 'splitUtt': splitUtt})
+  sys.stderr.write("Processed " + str(nSentences) + ' utterances\n')
 
-    # -------------------------------------------------------
-    # split utterance into tokens
-    # -------------------------------------------------------
-    # list of table rows 
-    if speaker != '':
-      if args.parameters == '':
-        outRows = wordPerLineChat(splitUtt, mor)
-      else:
-        outRows = wordPerLineTagger(splitUtt, mor)
+def chatBlocks(fileName, chunkSize=1 << 20):
+  # read a CHAT file in chunks of complete lines and split it into headers and utterances at the lines starting with '*'
+  # the blocks are those of file.read().split('\n*') with '@END' as delimiter, but only one chunk is kept in memory
+  # output: yields the blocks (without the '*')
+  with open(fileName, 'r', encoding="utf8") as file:  # , newline=''
+    block = []      # parts of the current block
+    newline = False # True if the block ends with a line break
+    rest = ''       # incomplete last line of the chunk
+    while True:
+      with stage('read'):
+        chunk = file.read(chunkSize)
+        count('input bytes', len(chunk))
+        text = rest + chunk
+        if chunk:
+          cut = text.rfind('\n') + 1
+          (text, rest) = (text[:cut], text[cut:])
+        ready = []      # complete blocks
+        if text != '':
+          parts = re.sub('@END', '*\n', text).split('\n*')   # insert delimiter at end of file, split utterances at '*', e.g. *CHI:
+          if newline and parts[0].startswith('*'):   # '\n*' across the chunk boundary
+            block[-1] = block[-1][:-1]
+            ready.append(''.join(block))
+            block = []
+            parts[0] = parts[0][1:]
+          block.append(parts[0])
+          if len(parts) > 1:
+            ready.append(''.join(block))
+            ready.extend(parts[1:-1])
+            block = [parts[-1]]
+          newline = parts[-1].endswith('\n')
+        if not chunk:
+          ready.append(''.join(block))
+      for b in ready:
+        yield(b)
+      if not chunk:
+        return
 
-  # ----------------------------------------
-  # TreeTagger (option -p)
-  # ----------------------------------------
-  if args.parameters != '':
-    sys.stderr.write('Running TreeTagger on taggerInput\n')
-    with open('tagthis.tmp', 'r') as tagthis:
-      taggerInput = tagthis.read()
-    (itemWords, itemPOS, itemLemmas, itemTagged) = treeTagger(taggerInput)
-
-  # ----------------------------------------
-  # output
-  # ----------------------------------------
-  # write output table: DictWriter matches header and rows, regardless of the order of fields in row
-  outHeader = ['utt_id', 'utt_nr', 'w_nr', 'speaker', 'child_project', 'age', 'age_days', 'time_code', 'word', 'lemma', 'pos', 'features', 'note', 'utterance', 'utt_clean', 'utt_tagged']
-  with open(args.out_file + '.csv', 'w', newline='') as out:   # newline '' is needed: we have commas in items
-    writer = csv.DictWriter(out, delimiter='\t', fieldnames=outHeader)
-    writer.writeheader()
-    writer.writerows(outRows)
-
-  # add tagger output
-  if args.parameters != '':
-    sys.stderr.write('Adding tagger output for each utterance...\n')
-    addTagging(args.out_file + '.csv', args.out_file + '.tagged.csv', outHeader, itemWords, itemPOS, itemLemmas, itemTagged)
-    sys.stderr.write("\nOutput file: " + args.out_file + '.tagged.csv\n')
-    sys.stderr.write("  you can delete the temporary file: " + args.out_file + '.csv\n')
-    sys.stderr.write("  you can delete the temporary files: tag*.tmp")
-  else:
-    sys.stderr.write("output was written to: " + args.out_file + '.csv\n')
-      
 #-------------------------------------------------------
 # functions
 #-------------------------------------------------------
@@ -180,67 +372,54 @@ def parseAge(age):
   age_days = int(int(year) * 365 + int(months) * 30.4 + int(days))
   return(age, age_days)
 
-def addTagging(inputFile, outputFile, outHeader, itemWords, itemPOS, itemLemmas, itemTagged):
-  # read the csv output file and add information from TreeTagger output
-  with open(inputFile, 'r') as csvfile:    # csv file with empty pos, lemma
-    with open(outputFile, 'w') as csvout:  # csv with filled columns
-      writer = csv.writer(csvout, delimiter = "\t")
-      reader = csv.reader(csvfile, delimiter = "\t")
-      data = list(reader)
-      # Iterate through each row and modify a specific cell in each row
-      for l, row in enumerate(data):
-        reMatch = re.compile('(.*)_w(\d+)') # get utterance ID (=key) and word number...
-        if re.search(reMatch, data[l][0]):  # ... from the first col of the row
-          m = re.search(reMatch, data[l][0])
-          uID = m.group(1)
-          wID = m.group(2)
-          lemma = itemLemmas[uID].split(' ')
-          pos = itemPOS[uID].split(' ')
-          annotation = []
-          # get column indexes from header
-          lemmaIndex = outHeader.index("lemma") if "lemma" in outHeader else None
-          posIndex = outHeader.index("pos") if "pos" in outHeader else None
-          featIndex = outHeader.index("features") if "features" in outHeader else None
-          uttIndex = outHeader.index("utterance") if "utterance" in outHeader else None
-          noteIndex = outHeader.index("note") if "note" in outHeader else None
-          # insert new lemma (col 9), pos (10), note (11)
-          try:
-            data[l][lemmaIndex] = lemma[int(wID)-1]
-          except IndexError:
-            print('   INDEX ERROR inserting lemma: %s\n' % data[l])
-          try:
-            data[l][posIndex] = pos[int(wID)-1]
-          except IndexError:
-            print('   INDEX ERROR inserting pos: %s\n' % data[l])
-
-          # ----------------------------------------
-          # output options
-          # ----------------------------------------
-          # -m : parse tagged output
-          if args.match_tagging != '':
-            tagged = itemTagged[uID]
-            try:
-              if re.search(re.compile(args.match_tagging), pos[int(wID)-1]): # if tagger pos matches argument
-                annotation = analyseTagging(tagged, lemma[int(wID)-1])
-                data[l][noteIndex] = ','.join(annotation)
-            except IndexError:
-              print('   INDEX ERROR annotation index 12 of: %s\n' % data[l])
-          # add a column with the tagger analysis 
-          if args.tagger_output:
-            index = outHeader.index("utt_tagged")
-            data[l][index] = tagged  # add the annotation values
-          # output option depending on tagger output
-          if args.pos_utterance:
-            uttIndex = outHeader.index("utterance") if "utterance" in outHeader else None
-            reMatch = re.compile(args.pos_utterance)
-            if posIndex <= len(data[l]) and not re.search(reMatch, data[l][posIndex]):
-              data[l][uttIndex] = ''  # add the annotation values
-
-          # output table row
-          writer.writerow(row)
-        else:
-          # output header row
-          writer.writerow(row)
+def addTagging(rows, itemPOS, itemLemmas, itemTagged, options):
+  # add information from TreeTagger output to the rows of the output table
+  for row in rows:
+    reMatch = re.compile('(.*)_w(\d+)') # get utterance ID (=key) and word number...
+    m = re.search(reMatch, row['utt_id'])  # ... from the first col of the row
+    uID = m.group(1)
+    wID = m.group(2)
+    lemma = itemLemmas[uID].split(' ')
+    pos = itemPOS[uID].split(' ')
+    tagged = itemTagged[uID]
+    annotation = []
+    # insert new lemma, pos, note
+    try:
+      row['lemma'] = lemma[int(wID)-1]
+    except IndexError:
+      count('INDEX ERRORs')
+      log.warning('   INDEX ERROR inserting lemma: %s\n', rowValues(row))
+    try:
+      row['pos'] = pos[int(wID)-1]
+    except IndexError:
+      count('INDEX ERRORs')
+      log.warning('   INDEX ERROR inserting pos: %s\n', rowValues(row))
+
+    # ----------------------------------------
+    # output options
+    # ----------------------------------------
+    # -m : parse tagged output
+    if options.match_tagging != '':
+      try:
+        if re.search(re.compile(options.match_tagging), pos[int(wID)-1]): # if tagger pos matches argument
+          annotation = analyseTagging(tagged, lemma[int(wID)-1])
+          row['note'] = ','.join(annotation)
+      except IndexError:
+        count('INDEX ERRORs')
+        log.warning('   INDEX ERROR annotation index 12 of: %s\n', rowValues(row))
+    # add a column with the tagger analysis
+    if options.tagger_output:
+      row['utt_tagged'] = tagged  # add the annotation values
+    # output option depending on tagger output
+    if options.pos_utterance:
+      reMatch = re.compile(options.pos_utterance)
+      if not re.search(reMatch, row['pos']):
+        row['utterance'] = ''  # add the annotation values
+  return(rows)
+
+def rowValues(row):
+  # values of a row in the order of the table columns (for messages)
+  return([str(row.get(col, '')) for col in outHeader])
 
 def analyseTagging(tagged, lemma):
   # parse tagger output
@@ -281,14 +460,21 @@ def insertAtIndex(add, list, index):
   if index < len(list):
     list[index] = add
   else:
+    count('INDEX ERRORs')
     sys.stderr.write('INDEX ERROR FOR LIST of len=' + str(len(list)) + ' index='+ str(index) + ' >>' + str(list) + '\n')
   return(list)
 
-def wordPerLineTagger(splitUtt, mor):
+def wordPerLineTagger(u, options):
   # for TreeTagger annotation: build one line (table row) for each token in utterance
+  # input:  utterance (dictionary, see readChat), options (see chatOptions)
+  # output: list of rows
+  splitUtt = u['splitUtt']
+  speaker = u['speaker']
+  childData = u['childData']
   age = tags = ''
   age_days = wNr = 0
   thisRow = {}
+  outRows = []
   words = tokenise(splitUtt).split(' ')
   for w in words:
     if w == '':
@@ -298,10 +484,10 @@ def wordPerLineTagger(splitUtt, mor):
     w = re.sub(r'@.*', '', w)
     # control if utterance is printed
     splitUttPrint = ''
-    if args.tagger_input:
+    if options.tagger_input:
       splitUttPrint = splitUtt
-    uttPrint = utt
-    if args.first_utterance and wNr > 1:
+    uttPrint = u['utt']
+    if options.first_utterance and wNr > 1:
       uttPrint = splitUttPrint = ''
     # read bio data for this speaker
     if childData.get(speaker) != None:
@@ -309,14 +495,14 @@ def wordPerLineTagger(splitUtt, mor):
       age_days = childData[speaker][2]
     # build output line for word
     thisRow = {
-      'utt_id': uttID + '_w' + str(wNr),
-      'utt_nr': sNr,
+      'utt_id': u['uttID'] + '_w' + str(wNr),
+      'utt_nr': u['sNr'],
       'w_nr': wNr,
       'speaker': speaker,
-      'child_project' : child,
+      'child_project' : u['child'],
       'age': age,
       'age_days': age_days,
-      'time_code': timeCode,
+      'time_code': u['timeCode'],
       'word': w,
       'pos': t,
       'lemma': l,
@@ -328,11 +514,18 @@ def wordPerLineTagger(splitUtt, mor):
     outRows.append(thisRow)   # append dictionary for this row to list of rows
   return(outRows)
 
-def wordPerLineChat(splitUtt, mor):
+def wordPerLineChat(u):
   # for CHAT format: build one line (table row) for each token in utterance
+  # input:  utterance (dictionary, see readChat)
+  # output: list of rows
+  splitUtt = u['splitUtt']
+  mor = u['mor']
+  speaker = u['speaker']
+  childData = u['childData']
   age = tags = ''
   age_days = wNr = 0
   thisRow = {}
+  outRows = []
   words = splitUtt.split(' ')
   if mor != '':
     tags = mor.split(' ')
@@ -364,20 +557,20 @@ def wordPerLineChat(splitUtt, mor):
       age_days = childData[speaker][2]
     # build output line for word
     thisRow = {
-      'utt_id': uttID + '_w' + str(wNr),
-      'utt_nr': sNr,
+      'utt_id': u['uttID'] + '_w' + str(wNr),
+      'utt_nr': u['sNr'],
       'w_nr': wNr,
       'speaker': speaker,
-      'child_project' : child,
+      'child_project' : u['child'],
       'age': age,
       'age_days': age_days,
-      'time_code': timeCode,
+      'time_code': u['timeCode'],
       'word': w,
       'pos': t,
       'lemma': l,
       'features': f,
       'note': equal,
-      'utterance': utt
+      'utterance': u['utt']
       }
     outRows.append(thisRow)   # append dictionary for this row to list of rows
 #    return(w,t,l,f)
@@ -418,37 +611,38 @@ def tokenise(s):
     s = re.sub(r'\s+', ' ', s)  # reduce spaces
     return(s)
 
-def treeTagger(str):
-    # input:  concatenated target items
+def treeTagger(str, parameters):
+    # input:  concatenated target items, TreeTagger parameter file
     # output: tagged items stored in dictionaries with item IDs as key
-    itemTagged = {}  # this dict stores tagged items in the format  Word_POS_Lemma ...
-    itemLemmas = {}  # this dict stores POS tags only
-    itemPOS = {}  # this dict stores POS tags only
-    itemWords = {}  # this dict stores words only
     taggerBin = os.path.expanduser('./tree-tagger')     # TreeTagger binary
     #paramFile = os.path.expanduser('./perceo-spoken-french-utf.par')    # TreeTagger parameters
-    paramFile = os.path.expanduser(args.parameters)    # TreeTagger parameters
+    paramFile = os.path.expanduser(parameters)    # TreeTagger parameters
     if not os.path.exists(taggerBin):   # verify if tagger files exist
         print("tree-tagger binary not found:", taggerBin, " - trying current working directory...")
         taggerBin = os.path.expanduser('./tree-tagger')     # TreeTagger binary
         if not os.path.exists(taggerBin):   # verify if tagger files exist
-            print("tree-tagger binary not found:", taggerBin, " - quitting.")
-            quit()
+            raise h2tools.InputError("tree-tagger binary not found: " + taggerBin)
     if not os.path.exists(paramFile):
         print("Parameter file not found:", paramFile, " -  trying current working directory...")
         paramFile = os.path.expanduser('./italian-utf.par')    # TreeTagger parameters
         if not os.path.exists(paramFile):
-            print("Parameter file not found:", paramFile, " - quitting.")
-            quit()
+            raise h2tools.InputError("Parameter file not found: " + paramFile)
     str = re.sub(r' +', r'\n', str)      # 1 word per line
-    with open('tagged.tmp', 'w') as tmp:
-      tmp.write(str)  # write header
-    # system call for TreeTagger: cat <tmp file>|tree-tagger parameters options
-    #    next line takes pipe output as input
-    #    check_output() returns output as a byte string that needs to be decoded using decode()
-    p1 = subprocess.Popen(["cat", 'tagged.tmp'], stdout=subprocess.PIPE)
-    tagged = subprocess.check_output([taggerBin, paramFile, '-token', '-lemma', '-sgml'], stdin=p1.stdout)
+    # TreeTagger: tree-tagger parameters options (or the tagging daemon, if it is running)
+    #    returns output as a byte string that needs to be decoded using decode()
+    tagged = h2tools.tagText(taggerBin, paramFile, str)
+    count('tagger bytes in', len(str.encode('utf8')))
+    count('tagger bytes out', len(tagged))
     tagged = tagged.decode('utf8')
+    return(parseTaggerOutput(tagged))
+
+def parseTaggerOutput(tagged):
+    # input:  TreeTagger output (word <tab> pos <tab> lemma, one word per line)
+    # output: tagged items stored in dictionaries with item IDs as key
+    itemTagged = {}  # this dict stores tagged items in the format  Word_POS_Lemma ...
+    itemLemmas = {}  # this dict stores POS tags only
+    itemPOS = {}  # this dict stores POS tags only
+    itemWords = {}  # this dict stores words only
     tagged = re.sub(r'\t([A-Za-z:]+)\t', r'_\1=', tagged)         # annotation format: word_pos=lemma ...
     tagged = re.sub(r'\n', ' ', tagged)                          # put everything on one line
     # Tagger corrections (TODO improve)
@@ -461,8 +655,7 @@ def treeTagger(str):
             m = re.search(reItem, sentence)
             sentence = re.sub(r'^([^>]+)> ', ' ', sentence)  # leave a initial space for word matching
         else:
-            print("Error: no item number found in item:", sentence)
-            quit()
+            raise h2tools.InputError("no item number found in tagger output: " + sentence)
         # generate output fields from each item
         key = m.group(1)
         itemTagged[key] = m.group(2)     #   dict   itemNr : sentence {A1:Il vaso si rompe}
@@ -506,5 +699,47 @@ Converts childes CHAT format data into one word per line table.
    parser.add_argument(
        '--tagger_output', action='store_true',
        help='print utterance as converted for tagger')
+   parser.add_argument(
+       '--profile', action='store_true',
+       help='print wall time per processing stage, throughput, counters and peak memory')
+   parser.add_argument(
+       '--metrics-json', default = "", type = str,
+       help='write the profile to this JSON file')
+   parser.add_argument(
+       '--trace-rules', default = "", type = str,
+       help='count matches and time of each regex rule, write a ranked report to this file')
+   parser.add_argument(
+       '--log-level', default = "WARNING", choices = ['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+       help='level of the per-row messages (e.g. INDEX ERROR = WARNING)')
+   parser.add_argument(
+       '--sample', default = 0, type = int,
+       help='process a random sample of this many utterances, stratified by child and age (half years).\n'
+            'Keeps up to this many utterances per stratum in memory (--sample-frac keeps only the sample)')
+   parser.add_argument(
+       '--sample-frac', default = 0.0, type = float,
+       help='process a random sample of this fraction of the utterances of each child and age')
+   parser.add_argument(
+       '--seed', default = 1, type = int,
+       help='random seed of the sample (same seed and input = same sample)')
+   parser.add_argument(
+       '--sort-by', default = "", type = str,
+       help='sort the output table by these columns, e.g. child_project,age_days,utt_nr')
+   parser.add_argument(
+       '--sort-buffer', default = 1000000, type = int,
+       help='with --sort-by: maximum number of rows sorted in memory, larger tables are sorted in temporary files')
    args = parser.parse_args()
+   args.sort_by = [c.strip() for c in args.sort_by.split(',') if c.strip() != '']
+   unknown = [c for c in args.sort_by if c not in outHeader]
+   if unknown:
+     parser.error("unknown columns in --sort-by: " + ', '.join(unknown) + " (columns: " + ', '.join(outHeader) + ")")
+   if args.sort_buffer < 1:
+     parser.error("option --sort-buffer must be at least 1")
+   if args.sample > 0 and args.sample_frac > 0:
+     parser.error("use either --sample or --sample-frac")
+   if not 0 <= args.sample_frac <= 1:
+     parser.error("option --sample-frac must be between 0 and 1")
+   logging.basicConfig(format='%(message)s', level=args.log_level)
+   h2tools.enableMetrics(args.profile or args.metrics_json != '')
+   if args.trace_rules != '':
+     h2tools.traceRules(sys.modules[__name__])
    main(args)
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+__author__ = "SILPAC H2"
+__version__ = "1.0"
+__email__ = "achim.stein@ling.uni-stuttgart.de"
+__license__ = "GPL"
+
+# Library interface of childes.py and pb1-parse-qualtrics.py, for notebooks and other Python scripts
+# The tables are returned in memory instead of being written to TSV files and read back:
+# - convertChat():    CHAT files -> token table (one word per line), like childes.py
+# - chatBatches():    the same table in batches of utterances, for corpora that do not fit in memory
+# - parseQualtrics(): Qualtrics export -> item table (and participant table), like pb1-parse-qualtrics.py
+# Tables are pandas DataFrames, or pyarrow Tables with arrow=True.
+# Input that cannot be processed raises h2tools.InputError. The console messages of the scripts
+# are suppressed unless verbose=True. After h2tools.enableMetrics(), h2tools.metricsReport() gives the profile
+# of the last call.
+#
+# Example:
+#   import sys; sys.path.insert(0, '<directory of this repository>')
+#   import h2api
+#   tokens = h2api.convertChat(['Paris.cha'], parameters='perceo-spoken-french-utf.par', match_tagging='VER')
+#   items = h2api.parseQualtrics('export.tsv', config='experiments/exp2-june2023.txt')
+
+import os
+import contextlib
+import importlib.util
+import h2tools
+import childes
+
+repoDir = os.path.dirname(os.path.abspath(__file__))
+scripts = {}   # name : module
+
+def loadScript(name, fileName):
+    # import a script of the repository as a module, once (pb1-parse-qualtrics.py has no importable name)
+    if name not in scripts:
+        spec = importlib.util.spec_from_file_location(name, os.path.join(repoDir, fileName))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        scripts[name] = module
+    return(scripts[name])
+
+@contextlib.contextmanager
+def console(verbose):
+    # show the progress messages of the scripts only if verbose
+    if verbose:
+        yield
+    else:
+        with open(os.devnull, 'w') as null, contextlib.redirect_stdout(null), contextlib.redirect_stderr(null):
+            yield
+
+def table(rows, columns, arrow=False):
+    # rows (list of dictionaries) as pandas DataFrame, or pyarrow Table if arrow
+    # missing values are empty strings, like in the TSV files
+    import pandas as pd
+    df = pd.DataFrame.from_records(rows, columns=columns).fillna('')
+    if arrow:
+        import pyarrow as pa
+        return(pa.Table.from_pandas(df, preserve_index=False))
+    return(df)
+
+# ----------------------------------------------------------------------
+# CHILDES
+# ----------------------------------------------------------------------
+def chatRowBatches(fileNames, batchSize, verbose, options):
+    # rows of childes.chatRows(), the console is redirected only while the rows are computed
+    if isinstance(fileNames, str):
+        fileNames = [fileNames]
+    h2tools.resetMetrics()
+    batches = childes.chatRows(fileNames, options, batchSize)
+    while True:
+        with console(verbose):
+            rows = next(batches, None)
+        if rows is None:
+            return
+        yield(rows)
+
+def chatBatches(fileNames, batchSize=10000, arrow=False, verbose=False, **options):
+    # convert CHAT files, yield one table per batch of utterances
+    # options: the command line options of childes.py (parameters, match_tagging, pos_utterance,
+    #          first_utterance, tagger_input, tagger_output, sample, sample_frac, seed),
+    #          e.g. parameters='perceo-spoken-french-utf.par'
+    # with parameters, each batch is tagged separately (tree-tagger must be in the working directory)
+    for rows in chatRowBatches(fileNames, batchSize, verbose, options):
+        yield(table(rows, childes.outHeader, arrow))
+
+def convertChat(fileNames, arrow=False, verbose=False, **options):
+    # convert CHAT files to one token table (options: see chatBatches)
+    allRows = []
+    for rows in chatRowBatches(fileNames, 0, verbose, options):
+        allRows.extend(rows)
+    return(table(allRows, childes.outHeader, arrow))
+
+# ----------------------------------------------------------------------
+# Qualtrics
+# ----------------------------------------------------------------------
+def parseQualtrics(fileName, config='', verbOrder=None, quest=False, geocode=False, sample=0, sample_frac=0.0, seed=1,
+                   arrow=False, verbose=False):
+    # convert a Qualtrics export to the item table of pb1-parse-qualtrics.py
+    # config:    experiment config file with the order of target verbs (see experiments/*.txt),
+    #            or verbOrder: list of verbs (default: Exp #2 June 2023)
+    # quest:     also return the participant data (table of option -q, with the column rowNr)
+    # geocode:   look up the address of the GPS location with Nominatim (slow, needs network access)
+    # sample, sample_frac, seed: analyse a random sample of the target items (options --sample, --sample-frac, --seed)
+    # output:    item table, or (item table, participant table) if quest
+    pb1 = loadScript('pb1', 'pb1-parse-qualtrics.py')
+    h2tools.resetMetrics()
+    with console(verbose):
+        pb1.resetReport()
+        if verbOrder is None:
+            verbOrder = pb1.readExperimentConfig(config) if config != '' else pb1.defaultVerbOrder
+        pb1.setExperiment(verbOrder)
+        respondents = pb1.readExport(fileName)
+        if sample > 0 or sample_frac > 0:
+            respondents = pb1.sampleItems(respondents, sample, sample_frac, seed)
+        analysis = pb1.analyseItems(respondents)
+        items = []
+        participants = []
+        for r in respondents:
+            items.extend(pb1.itemRows(r, analysis, len(items)))
+            if quest:
+                participants.append({'rowNr': r['rowNr'], **pb1.questRow(r['quest'], geocode)})
+    items = table(items, pb1.outHeader, arrow)
+    if quest:
+        columns = list(participants[0].keys()) if participants else ['rowNr']
+        return(items, table(participants, columns, arrow))
+    return(items)
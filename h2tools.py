@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+__author__ = "SILPAC H2"
+__version__ = "1.0"
+__email__ = "achim.stein@ling.uni-stuttgart.de"
+__license__ = "GPL"
+
+# Helpers shared by childes.py and pb1-parse-qualtrics.py
+# - errors: exception for input the scripts cannot process
+# - metrics: wall time per processing stage, counters, throughput, peak memory (options --profile, --metrics-json)
+# - rule tracing: calls, matches and time per regex rule (option --trace-rules)
+# - sampling: reproducible stratified random samples of the input (options --sample, --sample-frac)
+# - tagging: run TreeTagger through the tagging daemon (tagger-daemon.py) if it is running, else as a subprocess
+# Modules that are needed only for tagging are imported in the functions (fast start-up of the scripts).
+
+import sys
+import re
+import csv
+import time
+import os
+import json
+import contextlib
+from collections import defaultdict
+
+# ----------------------------------------------------------------------
+# errors
+# ----------------------------------------------------------------------
+class InputError(Exception):
+    # input file, tagger or parameter file that cannot be processed
+    # raised by the library functions, the command line scripts print the message and quit
+    pass
+
+# ----------------------------------------------------------------------
+# metrics
+# ----------------------------------------------------------------------
+metrics = {}
+metricsOn = False   # stage() and count() record only if enabled: no overhead in the hot loops without --profile
+
+def enableMetrics(on=True):
+    # record stage times and counters (options --profile, --metrics-json)
+    global metricsOn
+    metricsOn = on
+
+def resetMetrics():
+    # start a new measurement (e.g. for each experiment in batch mode)
+    metrics.clear()
+    metrics['start'] = time.perf_counter()
+    metrics['stages'] = defaultdict(float)   # stage : seconds
+    metrics['calls'] = defaultdict(int)      # stage : number of times the stage was entered
+    metrics['counters'] = defaultdict(int)   # counter : value (skipped rows, INDEX ERRORs, tagger bytes...)
+    metrics['units'] = {}                    # unit : number processed (utterances, items...)
+
+resetMetrics()
+
+noStage = contextlib.nullcontext()
+
+def stage(name):
+    # add the wall time of a block to a stage (if metrics are enabled)
+    # usage:  with stage('tagger'): ...
+    if not metricsOn:
+        return(noStage)
+    return(timedStage(name))
+
+@contextlib.contextmanager
+def timedStage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics['stages'][name] += time.perf_counter() - start
+        metrics['calls'][name] += 1
+
+def count(name, n=1):
+    # increment a counter (if metrics are enabled)
+    if metricsOn:
+        metrics['counters'][name] += n
+
+def setUnits(unit, n):
+    # number of units processed by the run, used for throughput
+    metrics['units'][unit] = n
+
+def peakRss():
+    # peak resident set size in MB of this process and of its finished children (tagger)
+    try:
+        import resource
+    except ImportError:    # not available on Windows
+        return(None, None)
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024   # ru_maxrss: bytes on macOS, KB on Linux
+    self = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale
+    return(round(self, 1), round(children, 1))
+
+def metricsReport():
+    # collect the metrics in a dictionary (can be written as JSON)
+    wall = time.perf_counter() - metrics['start']
+    (rssSelf, rssChildren) = peakRss()
+    report = {
+        'wall_seconds': round(wall, 3),
+        'stages': {name: {'seconds': round(sec, 3), 'calls': metrics['calls'][name], 'share': round(sec / wall, 3) if wall else 0}
+                   for name, sec in sorted(metrics['stages'].items(), key=lambda x: -x[1])},
+        'throughput_per_second': {unit: round(n / wall, 1) if wall else 0 for unit, n in metrics['units'].items()},
+        'units': dict(metrics['units']),
+        'counters': dict(metrics['counters']),
+        'peak_rss_mb': rssSelf,
+        'peak_rss_children_mb': rssChildren,
+        }
+    return(report)
+
+def printMetrics(report=None, file=sys.stderr):
+    # print the metrics as a table
+    if report is None:
+        report = metricsReport()
+    file.write("\n============== PROFILE ==============\n")
+    file.write("%-24s %10s %8s %10s\n" % ('stage', 'seconds', 'share', 'calls'))
+    for name, s in report['stages'].items():
+        file.write("%-24s %10.3f %7.1f%% %10d\n" % (name, s['seconds'], 100 * s['share'], s['calls']))
+    file.write("%-24s %10.3f\n" % ('total (wall)', report['wall_seconds']))
+    for unit, rate in report['throughput_per_second'].items():
+        file.write("%s: %d (%.1f per second)\n" % (unit, report['units'][unit], rate))
+    for name, value in sorted(report['counters'].items()):
+        file.write("%s: %d\n" % (name, value))
+    file.write("peak RSS: %s MB (tagger and other child processes: %s MB)\n" % (report['peak_rss_mb'], report['peak_rss_children_mb']))
+
+def writeMetricsJson(fileName, report=None):
+    # write the metrics to a JSON file
+    if report is None:
+        report = metricsReport()
+    with open(fileName, 'w') as out:
+        json.dump(report, out, indent=2)
+        out.write('\n')
+
+# ----------------------------------------------------------------------
+# rule tracing
+# ----------------------------------------------------------------------
+# The rules of both scripts are regexes called as re.sub(), re.search()... in their functions.
+# traceRules(module) replaces the name 're' in the module by a proxy that counts and times
+# every call. A rule is identified by the calling function and the pattern.
+# Without --trace-rules nothing is replaced, so there is no cost.
+
+ruleStats = defaultdict(lambda: [0, 0, 0, 0.0])   # (function, pattern) : [calls, hits, matches, seconds]
+
+def countMatches(method, result):
+    # number of matches found by a call of method
+    if method in ('sub', 'subn'):
+        return(result[1])
+    if method == 'findall':
+        return(len(result))
+    if method == 'split':
+        return(len(result) - 1)
+    if method == 'finditer':
+        return(len(result))
+    return(0 if result is None else 1)   # search, match, fullmatch
+
+def tracedCall(function, pattern, method, args, kwargs):
+    # call function (a method of re or of a compiled pattern, subn instead of sub)
+    # and record calls, hits, matches and time for the pattern
+    caller = sys._getframe(2).f_code.co_name
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    if method == 'finditer':
+        result = list(result)
+    seconds = time.perf_counter() - start
+    matches = countMatches(method, result)
+    stats = ruleStats[(caller, getattr(pattern, 'pattern', pattern))]
+    stats[0] += 1
+    stats[1] += matches > 0
+    stats[2] += matches
+    stats[3] += seconds
+    if method == 'sub':
+        return(result[0])
+    if method == 'finditer':
+        return(iter(result))
+    return(result)
+
+ruleMethods = ('search', 'match', 'fullmatch', 'sub', 'subn', 'findall', 'finditer', 'split')
+
+class TracedPattern:
+    # compiled pattern that records its calls
+    def __init__(self, compiled):
+        self.compiled = compiled
+    def __getattr__(self, name):
+        if name not in ruleMethods:
+            return(getattr(self.compiled, name))
+        function = getattr(self.compiled, 'subn' if name == 'sub' else name)
+        def call(*args, **kwargs):
+            return(tracedCall(function, self.compiled, name, args, kwargs))
+        return(call)
+
+class TracingRe:
+    # replaces the re module in a traced script
+    def __getattr__(self, name):
+        if name not in ruleMethods:
+            return(getattr(re, name))   # flags, escape, error...
+        function = getattr(re, 'subn' if name == 'sub' else name)
+        def call(pattern, *args, **kwargs):
+            if isinstance(pattern, TracedPattern):
+                pattern = pattern.compiled
+            return(tracedCall(function, pattern, name, (pattern,) + args, kwargs))
+        return(call)
+    def compile(self, pattern, flags=0):
+        if isinstance(pattern, TracedPattern):
+            return(pattern)
+        return(TracedPattern(re.compile(pattern, flags)))
+
+def traceRules(module):
+    # trace the regex rules of a module (call before the rules are compiled)
+    module.re = TracingRe()
+
+def ruleReport():
+    # rules ranked by accumulated time
+    # output: list of dictionaries
+    report = []
+    for (function, pattern), (calls, hits, matches, seconds) in ruleStats.items():
+        report.append({'function': function, 'pattern': pattern, 'calls': calls, 'hits': hits, 'matches': matches,
+                       'seconds': seconds, 'us_per_call': 1e6 * seconds / calls if calls else 0,
+                       'status': 'never matched' if hits == 0 else ''})
+    report.sort(key=lambda r: -r['seconds'])
+    return(report)
+
+def mergeRuleStats(report):
+    # add the rule report of another process (batch mode)
+    for r in report:
+        stats = ruleStats[(r['function'], r['pattern'])]
+        stats[0] += r['calls']
+        stats[1] += r['hits']
+        stats[2] += r['matches']
+        stats[3] += r['seconds']
+
+def writeRuleReport(fileName):
+    # write the ranked rule report as a table with tab delimiters
+    # rules that were never called (e.g. in branches that were not reached) are not listed
+    fields = ['rank', 'function', 'pattern', 'calls', 'hits', 'matches', 'seconds', 'us_per_call', 'status']
+    with open(fileName, 'w', newline='') as out:
+        writer = csv.DictWriter(out, delimiter='\t', fieldnames=fields)
+        writer.writeheader()
+        for rank, r in enumerate(ruleReport(), 1):
+            r['rank'] = rank
+            r['seconds'] = round(r['seconds'], 6)
+            r['us_per_call'] = round(r['us_per_call'], 2)
+            writer.writerow(r)
+    unmatched = sum(1 for stats in ruleStats.values() if stats[1] == 0)
+    sys.stderr.write("Rule trace: %d rules, %d never matched, written to %s\n" % (len(ruleStats), unmatched, fileName))
+
+# ----------------------------------------------------------------------
+# sampling
+# ----------------------------------------------------------------------
+# Every item of the input gets a random key (seeded, so the same input gives the same sample).
+# --sample N:      each stratum keeps the N items with the smallest keys (a reservoir), at the end
+#                  N is divided among the strata in proportion to their size and each stratum
+#                  contributes its items with the smallest keys. The input is read only once.
+# --sample-frac F: an item is selected if its key is smaller than F (about F of each stratum).
+# Memory: --sample keeps up to N items per stratum until the end of the input (the final size of the
+# strata is not known before), i.e. up to N x number of strata items; --sample-frac keeps only the sample.
+
+def allocateSample(size, counts, everyStratum=True):
+    # sample size per stratum, proportional to the size of the stratum (largest remainder method)
+    # everyStratum: if the sample is large enough, every stratum contributes at least one item
+    # input:  sample size, dictionary stratum : number of items
+    # output: dictionary stratum : number of items to select
+    total = sum(counts.values())
+    if size >= total:
+        return(dict(counts))
+    if everyStratum and size >= len(counts):
+        rest = allocateSample(size - len(counts), {s: n - 1 for s, n in counts.items()}, False)
+        return({s: rest[s] + 1 for s in counts})
+    quotas = {s: size * n / total for s, n in counts.items()}
+    allocation = {s: int(q) for s, q in quotas.items()}
+    rest = size - sum(allocation.values())
+    for s in sorted(quotas, key=lambda s: (allocation[s] - quotas[s], str(s)))[:rest]:   # largest remainders first
+        allocation[s] += 1
+    return(allocation)
+
+def stratifiedSample(items, stratum, size=0, frac=0.0, seed=1):
+    # reproducible stratified random sample of a stream of items, drawn in one pass
+    # input:  items (iterable, read once), stratum: function item -> stratum,
+    #         size: sample size, or frac: fraction of each stratum, seed: random seed
+    # output: list of the selected items in input order
+    import heapq
+    import random
+    rnd = random.Random(seed)
+    counts = defaultdict(int)         # stratum : number of items
+    reservoirs = defaultdict(list)    # stratum : heap of (-key, position, item) with the smallest keys
+    selected = []                     # (position, item)
+    for position, item in enumerate(items):
+        key = rnd.random()
+        s = stratum(item)
+        counts[s] += 1
+        if frac > 0:
+            if key < frac:
+                selected.append((position, item))
+            continue
+        heap = reservoirs[s]
+        if len(heap) < size:
+            heapq.heappush(heap, (-key, position, item))
+        elif key < -heap[0][0]:
+            heapq.heapreplace(heap, (-key, position, item))
+    if frac == 0:
+        for s, n in allocateSample(size, counts).items():
+            smallest = sorted(reservoirs[s], key=lambda x: -x[0])[:n]
+            selected.extend((position, item) for (key, position, item) in smallest)
+    selected.sort(key=lambda x: x[0])
+    sys.stderr.write("Sample: %d of %d items from %d strata (seed %d)\n" % (len(selected), sum(counts.values()), len(counts), seed))
+    return([item for position, item in selected])
+
+# ----------------------------------------------------------------------
+# tagging
+# ----------------------------------------------------------------------
+# Protocol of the tagging daemon (Unix socket, one request per connection):
+#   request:  JSON header line {"bin": ..., "par": ..., "options": [...], "bytes": n} + n bytes of tagger input
+#   reply:    JSON header line {"bytes": m} or {"error": ...} + m bytes of tagger output,
+#             preceded by empty lines (keep-alive) while the tagger is working
+
+taggerOptions = ['-token', '-lemma', '-sgml']
+daemonTimeout = 60   # seconds without an answer or keep-alive of the daemon before the tagger is started
+
+def daemonSocket():
+    # socket of the tagging daemon: $H2_TAGGER_SOCKET or h2-tagger-<user id>.sock in the runtime/temp directory
+    if os.environ.get('H2_TAGGER_SOCKET'):
+        return(os.environ['H2_TAGGER_SOCKET'])
+    import tempfile
+    runDir = os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir()
+    return(os.path.join(runDir, 'h2-tagger-%d.sock' % os.getuid()))
+
+def sendMessage(conn, header, data):
+    # send a JSON header line followed by data (bytes)
+    header['bytes'] = len(data)
+    conn.sendall(json.dumps(header).encode('utf8') + b'\n' + data)
+
+def receiveMessage(conn):
+    # receive a JSON header line and the data announced in it
+    # output: header (dictionary), data (bytes)
+    stream = conn.makefile('rb')
+    line = stream.readline()
+    while line == b'\n':   # keep-alive
+        line = stream.readline()
+    if not line:
+        raise ConnectionError("connection closed")
+    header = json.loads(line)
+    data = stream.read(header.get('bytes', 0))
+    return(header, data)
+
+def tagWithDaemon(taggerBin, paramFile, text):
+    # send text to the tagging daemon, output: tagger output (bytes)
+    import socket
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+        conn.settimeout(daemonTimeout)   # a daemon that stopped sending keep-alives raises socket.timeout (OSError)
+        conn.connect(daemonSocket())
+        sendMessage(conn, {'bin': os.path.abspath(taggerBin), 'par': os.path.abspath(paramFile), 'options': taggerOptions},
+                    text.encode('utf8'))
+        (header, data) = receiveMessage(conn)
+    if 'error' in header:
+        raise ConnectionError(header['error'])
+    return(data)
+
+def tagText(taggerBin, paramFile, text):
+    # tag text (one token per line) with TreeTagger
+    # uses the tagging daemon if it is running (parameter file already loaded), else starts the tagger
+    # output: tagger output (bytes)
+    if os.path.exists(daemonSocket()):
+        try:
+            data = tagWithDaemon(taggerBin, paramFile, text)
+            count('tagger daemon requests')
+            return(data)
+        except (OSError, json.JSONDecodeError) as e:    # daemon not running, failed or hanging: use the subprocess
+            sys.stderr.write("Tagging daemon not available (%s), starting tree-tagger\n" % e)
+    import subprocess
+    return(subprocess.run([taggerBin, paramFile] + taggerOptions, input=text.encode('utf8'),
+                          stdout=subprocess.PIPE, check=True).stdout)
@@ -5,43 +5,45 @@ __email__ = "(alessia.cassara|achim.stein)@ling.uni-stuttgart.de"
 __status__ = "tested with test items"
 __license__ = "GPL"
 
+# pandas (reading the export), numpy (option --stats) and geopy (option -q) are slow to import:
+# they are imported in the functions that need them, so that --help and small runs start fast
 import sys
-import argparse, pickle, re
-import pandas as pd   # a package for tables
-import numpy as np    # not sure if we need this
+import argparse, re
 import os
 import datetime
-from xmlrpc.client import boolean
-import subprocess   # for system commands, here: tree-tagger
+import json
 from collections import defaultdict   #  make dictionaries with initialised keys (avoids KeyError)
-from geopy.geocoders import Nominatim   # get region from gps coordinates
 import csv
+import contextlib
+import logging
+import h2tools    # shared helpers: metrics, rule tracing, tagging
+from h2tools import stage, count
+import concurrent.futures   # process pool for batch mode
 
 # ----------------------------------------------------------------------
 # set global variables
 # ----------------------------------------------------------------------
 errors = {} # store error analysis
 warnings = defaultdict(int) # store warnings
-geolocator = Nominatim(user_agent="geoapiExercises")
+geolocator = None   # Nominatim client, created for the first location (see processLocation)
+
+log = logging.getLogger('pb1-parse-qualtrics')
+tagger = {}  # TreeTagger binary and parameter file, located once per process
 
 # The order of verbs is defined in the Qualtrics input file
-# Exp #1 Nov 2022
-targetVerbOrder = ['rompere', 'rompere', 'rompere', 'bruciare', 'bruciare', 'bruciare', 'fermare', 'fermare', 'fermare', 'illuminare', 'illuminare', 'illuminare', 'affondare', 'affondare', 'affondare', 'aumentare', 'aumentare', 'aumentare', 'sciogliere', 'sciogliere', 'sciogliere', 'bagnare', 'bagnare', 'bagnare', 'curare', 'curare', 'curare', 'diminuire', 'diminuire', 'diminuire', 'aprire', 'aprire', 'aprire', 'bollire', 'bollire', 'bollire']
-# Exp #2 June 2023
-targetVerbOrder = ['fermare', 'fermare', 'fermare', 'affondare', 'affondare', 'affondare', 'rompere', 'rompere', 'rompere', 'curare', 'curare',
+# Each experiment has its own order, read from a config file (option --config, see experiments/*.txt)
+# Default: Exp #2 June 2023
+defaultVerbOrder = ['fermare', 'fermare', 'fermare', 'affondare', 'affondare', 'affondare', 'rompere', 'rompere', 'rompere', 'curare', 'curare',
 'curare', 'bruciare', 'bruciare', 'bruciare', 'bollire', 'bollire',
 'bollire', 'bagnare', 'bagnare', 'bagnare', 'sciogliere',
 'sciogliere', 'sciogliere', 'illuminare', 'illuminare', 'illuminare',
 'aprire', 'aprire', 'aprire', 'diminuire', 'diminuire', 'diminuire',
 'aumentare', 'aumentare', 'aumentare']
-# reduce list to types
-testedVerbs = set(targetVerbOrder)
-# build a regex to match the verb roots in target items
-testedVerbroots = list(map(lambda x: re.sub(r'.re', '', x), testedVerbs))   #  cut the suffix. map() applies the function to each item of the list
-testedVerbsRegex = '|'.join(testedVerbroots)
-print("===> target Items:", len(targetVerbOrder))
-print("===> tested Verbs:", len(testedVerbs), testedVerbs)
-print("===> regex for tested Verbs:", testedVerbsRegex)
+targetVerbOrder = []   # set by setExperiment()
+testedVerbsRegex = ''
+reTwoTestedVerbs = reTestedVerb = None   # regexes for getTargetAS, precompiled by setExperiment()
+# columns of the item table
+outHeader = ['outRowNr', 'ResponseId', 'listID', 'itemNr', 'verb', 'primeType', 'primeAnimacy', 'primeItem', 'targetGuess', 'targetType', 'targetDebug', 'targetItem', 'targetWords', 'targetPOS', 'targetTagged']
 
 
 # ----------------------------------------------------------------------
@@ -53,7 +55,7 @@ def get_arguments():
         description = ( "Convert results from Qualtrics experiment for R input." ),
         formatter_class = argparse.ArgumentDefaultsHelpFormatter)  # show default values in help text
     parser.add_argument(
-        "file_name",
+        "file_name", nargs = '?',
         help = "input data, table with tab delimiters")
     parser.add_argument(
         '-o', '--output', default = "", type = str,
@@ -61,7 +63,53 @@ def get_arguments():
     parser.add_argument(
         '-q', '--quest', default = "", type = str,
         help='Write questionnaire (participant data) to file')
+    parser.add_argument(
+        '-c', '--checkpoint', default = "", type = str,
+        help='Record processed ResponseIds in this file. If it exists, process only new respondents and append them to the output files')
+    parser.add_argument(
+        '-s', '--stats', default = "", type = str,
+        help='Write prime x target contingency tables and priming effects of the item table to file (requires -o)')
+    parser.add_argument(
+        '--config', default = "", type = str,
+        help='Experiment config file with the order of target verbs (default: Exp #2 June 2023)')
+    parser.add_argument(
+        '--profile', action='store_true',
+        help='Print wall time per processing stage, throughput, counters and peak memory')
+    parser.add_argument(
+        '--metrics-json', default = "", type = str,
+        help='Write the profile to this JSON file (batch mode: one entry per export)')
+    parser.add_argument(
+        '--trace-rules', default = "", type = str,
+        help='Count matches and time of each regex rule, write a ranked report to this file')
+    parser.add_argument(
+        '--log-level', default = "INFO", choices = ['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+        help='DEBUG prints an overview of every row')
+    parser.add_argument(
+        '--sample', default = 0, type = int,
+        help='Analyse a random sample of this many target items, stratified by list and verb (keeps up to this many items per stratum in memory)')
+    parser.add_argument(
+        '--sample-frac', default = 0.0, type = float,
+        help='Analyse a random sample of this fraction of the target items of each list and verb')
+    parser.add_argument(
+        '--seed', default = 1, type = int,
+        help='Random seed of the sample (same seed and input = same sample)')
+    parser.add_argument(
+        '-b', '--batch', default = "", type = str,
+        help='Process all the experiments listed in this manifest (table with tab delimiters, columns: export, config, output, quest, checkpoint, stats)')
+    parser.add_argument(
+        '-j', '--jobs', default = os.cpu_count(), type = int,
+        help='Number of experiments processed in parallel in batch mode')
     args = parser.parse_args()
+    if args.batch == '' and args.file_name is None:
+        parser.error("an input file or a manifest (option -b) is required")
+    if args.stats != '' and args.output == '':
+        parser.error("option --stats requires an item table (option -o)")
+    if args.sample > 0 and args.sample_frac > 0:
+        parser.error("use either --sample or --sample-frac")
+    if not 0 <= args.sample_frac <= 1:
+        parser.error("option --sample-frac must be between 0 and 1")
+    if (args.sample > 0 or args.sample_frac > 0) and (args.checkpoint != '' or args.batch != ''):
+        parser.error("a sample cannot be combined with a checkpoint (option -c) or batch mode (option -b)")
     return args
 
 # ----------------------------------------------------------------------
@@ -70,14 +118,106 @@ def get_arguments():
 
 def main():
     args = get_arguments()   # get command line options
-    if args.quest != '':
-        with open(args.quest, 'w') as quest:
-            quest.write("")
-            quest.close()
+    logging.basicConfig(format='%(message)s', level=args.log_level)
+    h2tools.enableMetrics(args.profile or args.metrics_json != '')
+    if args.batch != '':
+        failed = runBatch(args.batch, args.jobs, args.profile, args.metrics_json, args.log_level, args.trace_rules)
+        if failed > 0:
+            sys.exit(1)    # e.g. for make: the batch is not complete
+        quit()
+    if args.trace_rules != '':
+        h2tools.traceRules(sys.modules[__name__])
+    try:
+        if args.config != '':
+            setExperiment(readExperimentConfig(args.config))
+        else:
+            setExperiment(defaultVerbOrder)
+        processExport(args.file_name, args.output, args.quest, args.checkpoint, args.sample, args.sample_frac, args.seed)
+    except h2tools.InputError as e:
+        print(e, " - quitting.")
+        quit()
+    if args.stats != '':
+        with stage('stats'):
+            writeStats(args.output, args.stats)
+    printReport()
+    if args.profile:
+        h2tools.printMetrics()
+    if args.metrics_json != '':
+        h2tools.writeMetricsJson(args.metrics_json)
+    if args.trace_rules != '':
+        h2tools.writeRuleReport(args.trace_rules)
+    quit()
+
+def processExport(fileName, output, quest, checkpointFile, sample=0, sample_frac=0.0, seed=1):
+    # convert one Qualtrics export
+    # output, quest, checkpointFile: output files, ignored if empty
+    # sample, sample_frac: analyse only a random sample of the target items (see sampleItems)
+    (processedIds, lastRowNr, outPos, questPos) = readCheckpoint(checkpointFile)   # respondents written by a previous run
+    resume = len(processedIds) > 0
+    if resume:
+        print(f"===> Resuming from checkpoint {checkpointFile}: {len(processedIds)} respondents already processed.")
+    respondents = readExport(fileName, processedIds)
+    if sample > 0 or sample_frac > 0:
+        respondents = sampleItems(respondents, sample, sample_frac, seed)
+    analysis = analyseItems(respondents)
+    # rows are written respondent by respondent, so that an interrupted run can be resumed
+    with contextlib.ExitStack() as files:   # the files are closed if the run fails
+        out = questFile = checkpoint = None
+        if output != '':   # initialise the ouput files
+            print ("\n--- Writing items to file " + output)
+            if resume:
+                truncateOutput(output, outPos)
+            out = files.enter_context(open(output, 'a' if resume else 'w', newline=''))   # newline '' is needed: we have commas in items
+            writer = csv.DictWriter(out, delimiter='\t', fieldnames=outHeader)   # DictWriter matches header and rows, regardless of the order of fields in row
+            if not resume:
+                writer.writeheader()
+        if quest != '':
+            print ("\n--- Writing participants data to file " + quest)
+            if resume:
+                truncateOutput(quest, questPos)
+            questFile = files.enter_context(open(quest, 'a' if resume else 'w'))
+        if checkpointFile != '':
+            checkpoint = files.enter_context(open(checkpointFile, 'a'))
+        outRowNr = lastRowNr   # output row numbering, continued when resuming
+        questHeader = not resume    # write the questionnaire header before the first row
+        for r in respondents:
+            # everything is computed before anything is written: a failing respondent leaves no partial output
+            rows = []
+            if out is not None:
+                rows = itemRows(r, analysis, outRowNr)
+            if questFile is not None:
+                with stage('questionnaire'):
+                    thisQuest = questRow(r['quest'])
+            if out is not None:
+                with stage('write items'):
+                    writer.writerows(rows)
+                out.flush()
+                outRowNr += len(rows)
+            if questFile is not None:
+                with stage('questionnaire'):
+                    outputQuestionnaire(questFile, r['rowNr'], thisQuest, questHeader)    # output participant data
+                questFile.flush()
+                questHeader = False
+            # the respondent is recorded only after all its rows have been written, with the size of the output files
+            if checkpoint is not None:
+                positions = [str(f.tell()) if f is not None else '' for f in (out, questFile)]
+                checkpoint.write('\t'.join([r['checkpointId'], str(outRowNr)] + positions) + '\n')
+                checkpoint.flush()
+
+def truncateOutput(fileName, position):
+    # resume: remove the rows written after the last checkpoint line (by a run that failed)
+    if position != '' and os.path.exists(fileName):
+        os.truncate(fileName, int(position))
+
+def readExport(fileName, processedIds=set()):
+    # first pass: collect participant data, target items and prime values for each row of an export
+    # input:  Qualtrics export (table with tab delimiters), ResponseIds to skip
+    # output: list of respondents (each respondent is a dictionary)
     itemNumbers = {}     # dictionary to associate header with Pri_Tar number
-    args = get_arguments()   # get command line options
-    print("===> Reading input file: ", args.file_name)
-    df = pd.read_csv(args.file_name, sep='\t', dtype=str, header=0)   # define panda object, take first row as column headers
+    print("===> Reading input file: ", fileName)
+    with stage('read'):
+        import pandas as pd   # a package for tables
+        df = pd.read_csv(fileName, sep='\t', dtype=str, header=0)   # define panda object, take first row as column headers
 
     # SECOND ROW: row 1 is header, row 2 has index 0
     # we need the item number Argument_structure_prime
@@ -100,22 +240,26 @@ def main():
 
     # FOLLOWING ROWS: row 3 has index 1 in df
     # TODO clear conditions for calling the functions depending on the type of column
-    outRows = []   # define list of rows (each row is a dictionary)
-    outRowNr = 0   # output row numbering
+    respondents = []   # list of respondents (each respondent is a dictionary)
     for rowNr, row in df[1:].iterrows():    # iterate through rows 3- using commands of the Pandas library
         thisQuest = {}    # stores the questionnaire
         readQuest = True    # True if the questionnaire has been stored
         # verify some selection criteria
         if row.Finished == "False":
             warnings["not finished (skipped)"] += 1   # TODO better collect row numbers
+            count("skipped rows")
+            continue
+        responseId = row.ResponseId    # original ID, used for the checkpoint
+        if responseId in processedIds:
+            warnings["already processed (skipped)"] += 1
+            count("skipped rows")
             continue
         # verify some selection criteria
         if not re.search ("italian", str(row.Languages_1), re.IGNORECASE):
             warnings["not Italian L1 (skipped)"] += 1   # TODO better collect row numbers
             row.ResponseId = row.ResponseId + "_reject:Language1"
             # continue    # uncomment to skip
-        print("\n----ROW number", rowNr, "\n", row)    # display an overview of the row
-        taggerInput = ""     # will hold the concatenated input items: <s_A1> sentence <s_A2> sentence ....
+        log.debug("\n----ROW number %s\n%s", rowNr, row)    # display an overview of the row (--log-level DEBUG)
         items = {}     # dictionary colHead:item
         primeItem = defaultdict(str)
         for colHead, value in row.items():    # iterate through columns
@@ -133,7 +277,6 @@ def main():
                 itemID = listID + str(itemNumbers[colHead])     # add the item number to create a unique code
                 if itemNumbers[colHead] != 0:  # only for targets (not primes): append sentence
                     items[itemID] = value   # store the original input in dictionary
-                    taggerInput = taggerInput + " <s_" + itemID + "> " + value
             # 3) match column 699: content collected by Qualtrics plugin
             if colHead == "Argument_structure_prime":
                 primeType = getPrimeValues(value)  # get the dictionary relating itemID to type of prime
@@ -142,46 +285,97 @@ def main():
                 primeItem = getPrimeValues(value)
             if colHead == "Animacy_prime":
                 primeAnimacy = getPrimeValues(value)
+        respondents.append({
+            'rowNr': rowNr,
+            'checkpointId': responseId,
+            'ResponseId': row.ResponseId,
+            'quest': thisQuest,
+            'items': items,
+            'primeType': primeType,
+            'primeAnimacy': primeAnimacy,
+            'primeItem': primeItem })
+    return(respondents)
+
+def sampleItems(respondents, size=0, frac=0.0, seed=1):
+    # stratified random sample of the target items (options --sample, --sample-frac), strata: list x verb
+    # output: the respondents with the selected items only, respondents without selected items are dropped
+    def stratum(item):
+        itemID = item[1]
+        return((itemID[0], targetVerbOrder[int(itemID[1:])-1]))
+    items = ((i, itemID) for i, r in enumerate(respondents) for itemID in r['items'])
+    selected = defaultdict(set)   # respondent index : selected itemIDs
+    for i, itemID in h2tools.stratifiedSample(items, stratum, size, frac, seed):
+        selected[i].add(itemID)
+    sampled = []
+    for i, r in enumerate(respondents):
+        if i in selected:
+            sampled.append({**r, 'items': {k: v for k, v in r['items'].items() if k in selected[i]}})
+    return(sampled)
+
+def analyseItems(respondents):
+    # tag and analyse the target items of the respondents (see readExport)
+    # many participants type identical sentences: tag and analyse each distinct sentence only once
+    # output: dictionary  normalised sentence : (targetType, targetDebug, targetWords, targetPOS, targetTagged)
+    sentenceIDs = {}    # normalised sentence : sentence ID (S1, S2, ...)
+    itemTotal = 0
+    for r in respondents:
+        for itemID, value in r['items'].items():
+            itemTotal += 1
+            sentence = normaliseItem(value)
+            if sentence not in sentenceIDs:
+                sentenceIDs[sentence] = 'S' + str(len(sentenceIDs) + 1)
+    print(f"===> Distinct target sentences: {len(sentenceIDs)} of {itemTotal} items")
+    h2tools.setUnits('respondents', len(respondents))
+    h2tools.setUnits('items', itemTotal)
+    count('distinct sentences', len(sentenceIDs))
+    if not sentenceIDs:    # e.g. no new respondents since the checkpoint: don't start the tagger
+        return({})
+    taggerInput = ''.join(" <s_" + sID + "> " + sentence for sentence, sID in sentenceIDs.items())
+    with stage('tagger'):
+        (itemWords, itemPOS, itemTagged) = treeTagger(taggerInput)     # dictionaries containing the tagged sentences
+    analysis = {}
+    with stage('getTargetAS'):
+        for sentence, sID in sentenceIDs.items():
+            (targetType, targetDebug) = getTargetAS(itemPOS[sID], itemTagged[sID])     # rules for analysing the annotated sentence
+            analysis[sentence] = (targetType, targetDebug, itemWords[sID], itemPOS[sID], itemTagged[sID])
+    return(analysis)
+
+def itemRows(r, analysis, outRowNr=0):
+    # second pass: fan the results out to every (ResponseId, itemID)
+    # input:  respondent (see readExport), analysis (see analyseItems), last output row number
+    # output: list of item rows (one per target item, keys: outHeader)
+    rows = []
+    for key, value in r['items'].items():    # output each item in a separate row (v1.1: using DictWriter)
+        (targetType, targetDebug, targetWords, targetPOS, targetTagged) = analysis[normaliseItem(value)]
+        m = re.search(r'([A-Z])(\d+)', key)   # separate list and item ID
+        listID=m.group(1)
+        itemNr=m.group(2)
+        outRowNr += 1
+        rows.append({
+            'outRowNr': outRowNr,
+            'ResponseId': r['ResponseId'],
+            'listID': listID,
+            'itemNr': itemNr,
+            'verb': targetVerbOrder[int(itemNr)-1],
+            'primeType': r['primeType'][key],
+            'primeAnimacy': r['primeAnimacy'][key],
+            'primeItem': r['primeItem'][key],
+            'targetGuess': targetType,
+            'targetType': targetType + '?',
+            'targetDebug': targetDebug,
+            'targetItem': value,
+            'targetWords': targetWords,
+            'targetPOS': targetPOS,
+            'targetTagged': targetTagged })
+    return(rows)
+
+def resetReport():
+    # forget the tagging errors and warnings of the previous export
+    global errors, warnings
+    errors = {}
+    warnings = defaultdict(int)
 
-        # end of column processing. Launch TreeTagger
-        (itemWords, itemPOS, itemTagged) = treeTagger(taggerInput)     # dictionary containing the tagged target items
-        if args.quest != '':
-            outputQuestionnaire(rowNr, thisQuest)    # output participant data
-        if args.output != '':
-            debugTarget = 0   # reset the counter for calls of getTargetAS
-            for key in itemTagged.keys():            # output each item in a separate row (v1.1: using DictWriter)
-                (targetType, targetDebug) = getTargetAS(itemPOS[key], itemTagged[key])     # rules for analysing the annotated sentence
-                m = re.search(r'([A-Z])(\d+)', key)   # separate list and item ID
-                listID=m.group(1)
-                itemNr=m.group(2)
-                outRowNr += 1
-                thisRow = {
-                    'outRowNr': outRowNr,
-                    'ResponseId': row.ResponseId,
-                    'listID': listID,
-                    'itemNr': itemNr,
-                    'verb': targetVerbOrder[int(itemNr)-1],
-                    'primeType': primeType[key],
-                    'primeAnimacy': primeAnimacy[key],
-                    'primeItem': primeItem[key],
-                    'targetGuess': targetType,
-                    'targetType': targetType + '?',
-                    'targetDebug': targetDebug,
-                    'targetItem': items[key],
-                    'targetWords': itemWords[key],
-                    'targetPOS': itemPOS[key],
-                    'targetTagged': itemTagged[key] }
-                outRows.append(thisRow)   # append dictionary for this row to list of rows
-    # end of processing input lines / end of file
-    # write output table: DictWriter matches header and rows, regardless of the order of fields in row
-#    outLine = "(c) SILPAC " + str(today)  # put a date in first cell of header row
-    outHeader = ['outRowNr', 'ResponseId', 'listID', 'itemNr', 'verb', 'primeType', 'primeAnimacy', 'primeItem', 'targetGuess', 'targetType', 'targetDebug', 'targetItem', 'targetWords', 'targetPOS', 'targetTagged']
-    if args.output != '':   # initialise the ouput files
-        print ("\n--- Writing items to file " + args.output)
-        with open(args.output, 'w', newline='') as out:   # newline '' is needed: we have commas in items
-            writer = csv.DictWriter(out, delimiter='\t', fieldnames=outHeader)
-            writer.writeheader()
-            writer.writerows(outRows)
+def printReport():
     print ("\n============== TAGGING ERRORS ==============")
     for key in errors.keys():
         print ("\n===>ERROR:", key)
@@ -190,7 +384,202 @@ def main():
     print ("\n============== WARNINGS ==============")
     for key in warnings.keys():
         print (warnings[key], " warning(s) for: ", key, sep="")
-    quit()
+
+#----------------------------------------------------------------------
+# statistics (option --stats)
+#----------------------------------------------------------------------
+def encodeColumn(values):
+    # integer-code a column of the item table
+    # output: array of levels, array of codes (index into levels)
+    import numpy as np    # vectorized statistics
+    levels, codes = np.unique(np.array(values, dtype=str), return_inverse=True)
+    return(levels, codes.reshape(-1))
+
+def crossTab(groups, nGroups, rows, nRows, cols, nCols):
+    # count the combinations group x row x col in one pass
+    # output: array of counts with shape (nGroups, nRows, nCols)
+    import numpy as np
+    cells = (groups * nRows + rows) * nCols + cols
+    return(np.bincount(cells, minlength=nGroups * nRows * nCols).reshape(nGroups, nRows, nCols))
+
+def writeStats(itemFile, statsFile):
+    # cross-tabulate primeType and primeAnimacy against targetGuess, overall, per verb, list and participant
+    # input:  item table written by processExport (option -o)
+    # output: long table with tab delimiters: table, group, prime, target, n, prop
+    #         prop is the proportion of the target type among the items with this prime
+    #         table 'primingEffect' gives the proportion of targets with the same type as the prime
+    import numpy as np    # vectorized statistics
+    columns = defaultdict(list)
+    with open(itemFile, 'r', newline='') as items:
+        for row in csv.DictReader(items, delimiter='\t'):
+            for col in ['ResponseId', 'listID', 'verb', 'primeType', 'primeAnimacy', 'targetGuess']:
+                columns[col].append(row[col])
+    nItems = len(columns['targetGuess'])
+    if nItems == 0:
+        print("No items for statistics in", itemFile)
+        return()
+    (targetLevels, target) = encodeColumn(columns['targetGuess'])
+    groupings = [('all', np.array(['all']), np.zeros(nItems, dtype=int))]
+    for (name, col) in [('verb', 'verb'), ('list', 'listID'), ('participant', 'ResponseId')]:
+        (levels, codes) = encodeColumn(columns[col])
+        groupings.append((name, np.char.add(name + ':', levels), codes))
+    print ("\n--- Writing statistics to file " + statsFile)
+    with open(statsFile, 'w', newline='') as out:
+        writer = csv.writer(out, delimiter='\t')
+        writer.writerow(['table', 'group', 'prime', 'target', 'n', 'prop'])
+        for primeCol in ['primeType', 'primeAnimacy']:
+            (primeLevels, prime) = encodeColumn(columns[primeCol])
+            for (name, groupLevels, group) in groupings:
+                counts = crossTab(group, len(groupLevels), prime, len(primeLevels), target, len(targetLevels))
+                totals = counts.sum(axis=2, keepdims=True)
+                props = np.divide(counts, totals, out=np.zeros(counts.shape), where=totals > 0)
+                for (g, p, t) in zip(*np.nonzero(counts)):
+                    writer.writerow([primeCol + ' x targetGuess', groupLevels[g], primeLevels[p], targetLevels[t], counts[g, p, t], round(props[g, p, t], 4)])
+                if primeCol == 'primeType':
+                    printTable(name, groupLevels, primeLevels, targetLevels, counts)
+        # priming effect: target type identical to prime type
+        (primeLevels, prime) = encodeColumn(columns['primeType'])
+        same = (primeLevels[prime] == targetLevels[target]).astype(int)
+        for (name, groupLevels, group) in groupings:
+            cells = group * len(primeLevels) + prime
+            n = np.bincount(cells, minlength=len(groupLevels) * len(primeLevels)).reshape(len(groupLevels), len(primeLevels))
+            hits = np.bincount(cells, weights=same, minlength=len(groupLevels) * len(primeLevels)).reshape(len(groupLevels), len(primeLevels))
+            for (g, p) in zip(*np.nonzero(n)):
+                writer.writerow(['primingEffect', groupLevels[g], primeLevels[p], '=prime', n[g, p], round(hits[g, p] / n[g, p], 4)])
+    return()
+
+def printTable(name, groupLevels, primeLevels, targetLevels, counts):
+    # print the overall primeType x targetGuess table for a quick check
+    if name != 'all':
+        return()
+    print ("\n============== primeType x targetGuess ==============")
+    print ("prime", *targetLevels, sep='\t')
+    for p, primeLevel in enumerate(primeLevels):
+        print (primeLevel, *counts[0, p], sep='\t')
+    return()
+
+#----------------------------------------------------------------------
+# experiments and batch mode
+#----------------------------------------------------------------------
+def readExperimentConfig(fileName):
+    # read the order of target verbs from an experiment config file
+    # input:  config file: verbs separated by spaces or newlines, comments start with '#'
+    # output: list of verbs, item 1 first
+    verbOrder = []
+    with open(fileName, 'r') as config:
+        for line in config:
+            line = re.sub(r'#.*', '', line)
+            verbOrder.extend(line.split())
+    if len(verbOrder) == 0:
+        raise h2tools.InputError("No target verbs found in config file: " + fileName)
+    return(verbOrder)
+
+def setExperiment(verbOrder):
+    # set the target verbs of the experiment and precompile the regexes used by getTargetAS
+    global targetVerbOrder, testedVerbsRegex, reTwoTestedVerbs, reTestedVerb
+    targetVerbOrder = verbOrder
+    # reduce list to types
+    testedVerbs = set(targetVerbOrder)
+    # build a regex to match the verb roots in target items
+    testedVerbroots = list(map(lambda x: re.sub(r'.re', '', x), testedVerbs))   #  cut the suffix. map() applies the function to each item of the list
+    testedVerbsRegex = '|'.join(testedVerbroots)
+    reTwoTestedVerbs = re.compile("VER:[a-z]+=(" + testedVerbsRegex + ").*" + "VER:[a-z]+=(" + testedVerbsRegex + ")")
+    reTestedVerb = re.compile(".*VER:[a-z]+=("+ testedVerbsRegex + ").*")   # regex must expand to the complete item
+    print("===> target Items:", len(targetVerbOrder))
+    print("===> tested Verbs:", len(testedVerbs), testedVerbs)
+    print("===> regex for tested Verbs:", testedVerbsRegex)
+
+def readManifest(fileName):
+    # read the list of experiments for batch mode
+    # input:  table with tab delimiters and a header row: export, config, output, quest, checkpoint, stats
+    #         relative paths are relative to the directory of the manifest
+    # output: list of jobs (each job is a dictionary)
+    jobs = []
+    baseDir = os.path.dirname(os.path.abspath(fileName))
+    with open(fileName, 'r', newline='') as manifest:
+        for row in csv.DictReader(manifest, delimiter='\t'):
+            job = {}
+            for col in ['export', 'config', 'output', 'quest', 'checkpoint', 'stats']:
+                value = (row.get(col) or '').strip()
+                if value != '':
+                    value = os.path.join(baseDir, os.path.expanduser(value))
+                job[col] = value
+            if job['export'] == '':
+                continue
+            jobs.append(job)
+    return(jobs)
+
+def initWorker():
+    # each worker process locates its own tagger once
+    findTagger()
+
+def runExperiment(job):
+    # process one experiment of the manifest in a worker process
+    # console output and log messages go to a log file next to the output
+    resetReport()
+    h2tools.resetMetrics()
+    h2tools.enableMetrics(job['metrics'])
+    if job['traceRules']:
+        h2tools.traceRules(sys.modules[__name__])
+        h2tools.ruleStats.clear()   # report only the rules of this experiment
+    logFile = (job['output'] or job['export']) + '.log'
+    with open(logFile, 'w') as logOut:
+        handler = logging.StreamHandler(logOut)
+        (propagate, level) = (log.propagate, log.level)
+        log.addHandler(handler)
+        log.propagate = False
+        log.setLevel(job['logLevel'])
+        try:
+            with contextlib.redirect_stdout(logOut):
+                if job['config'] != '':
+                    setExperiment(readExperimentConfig(job['config']))
+                else:
+                    setExperiment(defaultVerbOrder)
+                processExport(job['export'], job['output'], job['quest'], job['checkpoint'])
+                if job['stats'] != '' and job['output'] != '':
+                    with stage('stats'):
+                        writeStats(job['output'], job['stats'])
+                printReport()
+                report = h2tools.metricsReport()
+                if job['profile']:
+                    h2tools.printMetrics(report, file=logOut)
+        finally:   # the worker process is reused by the next experiment, also if this one failed
+            log.removeHandler(handler)
+            log.propagate = propagate
+            log.setLevel(level)
+    return(logFile, sum(warnings.values()), len(errors), report, h2tools.ruleReport())
+
+def runBatch(manifestFile, jobs, profile, metricsJson, logLevel, traceFile):
+    # process the experiments of a manifest concurrently
+    # output: number of experiments that failed
+    experiments = readManifest(manifestFile)
+    print(f"===> Batch: {len(experiments)} experiments, {jobs} parallel jobs")
+    reports = {}   # output (or export) : metrics
+    failed = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=initWorker) as pool:
+        futures = {}
+        for job in experiments:
+            job.update({'profile': profile, 'metrics': profile or metricsJson != '', 'logLevel': logLevel, 'traceRules': traceFile != ''})
+            futures[pool.submit(runExperiment, job)] = job
+        for future in concurrent.futures.as_completed(futures):
+            job = futures[future]
+            try:
+                (logFile, nWarnings, nErrors, reports[job['output'] or job['export']], rules) = future.result()
+            except Exception as e:    # e.g. InputError (tagger or config file not found)
+                print("!!!!! FAILED:", job['export'], repr(e))
+                failed += 1
+                continue
+            h2tools.mergeRuleStats(rules)
+            print(f"---- done: {job['export']} ({nWarnings} warnings, {nErrors} error types), see {logFile}")
+    if metricsJson != '':
+        with open(metricsJson, 'w') as out:
+            json.dump(reports, out, indent=2)
+            out.write('\n')
+    if traceFile != '':
+        h2tools.writeRuleReport(traceFile)   # rules of all experiments
+    if failed > 0:
+        print(f"!!!!! {failed} of {len(experiments)} experiments failed")
+    return(failed)
 
 
 #----------------------------------------------------------------------
@@ -204,35 +593,54 @@ def parseInput(value):     # parse what participants typed in the textbox
     # TODO...... code Alessia's conditions
     return()
 
-def treeTagger(str):
-    # input:  concatenated target items
-    # output: tagged items stored in dictionaries with item IDs as key
-    itemTagged = {}  # this dict stores tagged items in the format  Word_POS_Lemma ...
-    itemPOS = {}  # this dict stores POS tags only
-    itemWords = {}  # this dict stores words only
+def normaliseItem(value):
+    # normalise a typed sentence so that identical answers are tagged only once
+    # input:  item as typed by the participant
+    # output: item with leading, trailing and repeated whitespace removed
+    return(re.sub(r'\s+', ' ', value).strip())
+
+def findTagger():
+    # locate TreeTagger binary and parameter file (once per process)
+    # output: binary, parameter file
+    if tagger:
+        return(tagger['bin'], tagger['par'])
     taggerBin = os.path.expanduser('~/Nextcloud/H2-shared/cmd/tree-tagger')     # TreeTagger binary
     paramFile = os.path.expanduser('~/Nextcloud/H2-shared/experiments/unacc-it/italian-utf.par')    # TreeTagger parameters
     if not os.path.exists(taggerBin):   # verify if tagger files exist
         print("tree-tagger binary not found:", taggerBin, " - trying current working directory...")
         taggerBin = os.path.expanduser('./tree-tagger')     # TreeTagger binary
         if not os.path.exists(taggerBin):   # verify if tagger files exist
-            print("tree-tagger binary not found:", taggerBin, " - quitting.")
-            quit()
+            raise h2tools.InputError("tree-tagger binary not found: " + taggerBin)
     if not os.path.exists(paramFile):
         print("Parameter file not found:", paramFile, " -  trying current working directory...")
         paramFile = os.path.expanduser('./italian-utf.par')    # TreeTagger parameters
         if not os.path.exists(paramFile):
-            print("Parameter file not found:", paramFile, " - quitting.")
-            quit()
+            raise h2tools.InputError("Parameter file not found: " + paramFile)
+    tagger['bin'] = taggerBin
+    tagger['par'] = paramFile
+    return(taggerBin, paramFile)
+
+def treeTagger(str):
+    # input:  concatenated target items
+    # output: tagged items stored in dictionaries with item IDs as key
+    (taggerBin, paramFile) = findTagger()
     str = re.sub(r'([\'\´\`])', r'\1 ', str)        # quick & dirty tokenization
     str = re.sub(r'([\"\.\!,;:])', r' \1 ', str)
     str = re.sub(r' +', r'\n', str)      # 1 word per line
-    # system call for TreeTagger: echo + output to pipe: echo "bla"|tree-tagger parameters options
-    #    next line takes pipe output as input
-    #    check_output() returns output as a byte string that needs to be decoded using decode()
-    p1 = subprocess.Popen(["echo", str], stdout=subprocess.PIPE)
-    tagged = subprocess.check_output([taggerBin, paramFile, '-token', '-lemma', '-sgml'], stdin=p1.stdout)
+    # TreeTagger: tree-tagger parameters options (or the tagging daemon, if it is running)
+    #    returns output as a byte string that needs to be decoded using decode()
+    tagged = h2tools.tagText(taggerBin, paramFile, str + '\n')
+    count('tagger bytes in', len(str.encode('utf8')))
+    count('tagger bytes out', len(tagged))
     tagged = tagged.decode('utf8')
+    return(parseTaggerOutput(tagged))
+
+def parseTaggerOutput(tagged):
+    # input:  TreeTagger output (word <tab> pos <tab> lemma, one word per line)
+    # output: tagged items stored in dictionaries with item IDs as key, tagging errors corrected
+    itemTagged = {}  # this dict stores tagged items in the format  Word_POS_Lemma ...
+    itemPOS = {}  # this dict stores POS tags only
+    itemWords = {}  # this dict stores words only
     tagged = re.sub(r'\t([A-Za-z:]+)\t', r'_\1=', tagged)         # format annotation format: word_pos=lemma ...
     tagged = re.sub(r'\n', r' ', tagged)                          # put everything on one line
     for sentence in tagged.split("<s_"): #taggedItems:    # split the concatenated items
@@ -252,8 +660,7 @@ def treeTagger(str):
         if re.search(r'^[A-Z]\d+>', sentence):     # get the item number from the rest of code, e.g. (<s_)A23
             matches = re.search(r'^([A-Z])(\d+)> *(.*?) ?$', sentence)
         else:
-            print("Error: no item number found in item:", sentence)
-            quit()
+            raise h2tools.InputError("Error: no item number found in item: " + sentence)
         # generate output fields from each item
         key = matches.group(1) + matches.group(2)
         itemTagged[key] = matches.group(3)     #   dict   itemNr : sentence {A1:Il vaso si rompe}
@@ -315,13 +722,12 @@ def getTargetAS(pos, full):
     fullL = full.split(" ")
     # 1) improve unanalysable cases: if more than 1 verb, find the relevant verb using the lemma (testedVerbs)
     if re.search(r' VER.* VER', pos):    # more than 1 verb
-        r = re.compile("VER:[a-z]+=(" + testedVerbsRegex + ").*" + "VER:[a-z]+=(" + testedVerbsRegex + ")")
-        if re.search(r, full):
+        if re.search(reTwoTestedVerbs, full):
             append = "_err:tooManyVerbs"    # append error message. Undecidable: two verbs match the list of tested verbs
         else:
             # we match the testedVerbs (as regex) against the *list* of pos
-            r = re.compile(".*VER:[a-z]+=("+ testedVerbsRegex + ").*")   # regex must expand to the complete item
-            matches = list(filter(r.match, fullL)) # we retrieve the matching element
+            # reTestedVerb must expand to the complete item
+            matches = list(filter(reTestedVerb.match, fullL)) # we retrieve the matching element
             if len(matches) == 1:                  # if only one element matches...
                 wordNr = fullL.index(matches[0])   # ...determine the position of the matched word in the list
                 posL[wordNr] = re.sub("VER", "VOK", posL[wordNr])  # temporarily rename VER > VOK for this element
@@ -371,6 +777,10 @@ def getTargetAS(pos, full):
 
 
 def processLocation(Latitude, Longitude):
+    global geolocator
+    if geolocator is None:
+        from geopy.geocoders import Nominatim   # get region from gps coordinates
+        geolocator = Nominatim(user_agent="geoapiExercises")
     location = geolocator.reverse(Latitude+","+Longitude)
     if location is None:
         return('NA')
@@ -380,38 +790,52 @@ def processLocation(Latitude, Longitude):
     country = address.get('country', '')
     return(city + ", " + str(zipcode) + ", " + country)
 
-def outputQuestionnaire(rowNr, thisQuest):
-    thisQuest["addAddress"] = "dummy"
-    thisQuest["addAddress"] = processLocation(thisQuest["LocationLatitude"], thisQuest["LocationLongitude"])
+def outputQuestionnaire(quest, rowNr, thisQuest, header):
+    # quest:  open questionnaire file
+    # thisQuest: participant data (see questRow)
+    # header: True if the table header has to be written before the row
     #print(thisQuest)
-    args = get_arguments()   # get command line options
-    if args.quest != '':
-        print ("\n--- Writing participants data to file " + args.quest)
-        with open(args.quest, 'a') as out:   #### TODO: this stores only the last line
-            if rowNr == 1:      # if first line, write keys as table header
-                today = datetime.date.today()
-                outLine = "(c) SILPAC " + str(today)  # put a date in first cell of header row
-                outLine = outLine + '\t' + '\t'.join(thisQuest.keys())   # add the concatenated dictionary keys
-                out.write(outLine + '\n')
-            outLine = str(rowNr) + '\t' + '\t'.join(thisQuest.values())   # add the concatenated dictionary values
-            out.write(outLine + '\n')
+    if header:      # if first line, write keys as table header
+        today = datetime.date.today()
+        outLine = "(c) SILPAC " + str(today)  # put a date in first cell of header row
+        outLine = outLine + '\t' + '\t'.join(thisQuest.keys())   # add the concatenated dictionary keys
+        quest.write(outLine + '\n')
+    outLine = str(rowNr) + '\t' + '\t'.join(thisQuest.values())   # add the concatenated dictionary values
+    quest.write(outLine + '\n')
     return()
 
-def outputItems(rowNr, itemTagged):
-    thisQuest["addAddress"] = "dummy"
-    thisQuest["addAddress"] = processLocation(thisQuest["LocationLatitude"], thisQuest["LocationLongitude"])
-    #print(thisQuest)
-    args = get_arguments()   # get command line options
-    if args.output != '':
-        with open(args.output, 'a') as quest:   #### TODO: this stores only the last line
-            if rowNr == 1:      # if first line, write keys as table header
-                today = datetime.date.today()
-                outLine = "(c) SILPAC " + str(today)  # put a date in first cell of header row
-                outLine = outLine + '\t' + '\t'.join(thisQuest.keys())   # add the concatenated dictionary keys
-                quest.write(outLine + '\n')
-            outLine = str(rowNr) + '\t' + '\t'.join(thisQuest.values())   # add the concatenated dictionary values
-            quest.write(outLine + '\n')
-    return()
+def questRow(thisQuest, geocode=True):
+    # participant data of a respondent (see readExport) with the address of the GPS location
+    thisQuest = dict(thisQuest)
+    thisQuest["addAddress"] = ""
+    if geocode:
+        with stage('geocode (Nominatim)'):
+            thisQuest["addAddress"] = processLocation(thisQuest["LocationLatitude"], thisQuest["LocationLongitude"])
+    return(thisQuest)
+
+def readCheckpoint(fileName):
+    # read the checkpoint written by a previous run
+    # input:  checkpoint file, lines: ResponseId <tab> last outRowNr <tab> size of item file <tab> size of questionnaire
+    #         (sizes are empty if the file was not written, checkpoints of older versions have no sizes)
+    # output: set of processed ResponseIds, last output row number, sizes of the item file and questionnaire ('': unknown)
+    processedIds = set()
+    lastRowNr = 0
+    outPos = questPos = ''
+    if fileName == '' or not os.path.exists(fileName):
+        return(processedIds, lastRowNr, outPos, questPos)
+    with open(fileName, 'r') as checkpoint:
+        for line in checkpoint:
+            if not line.endswith('\n'):    # incomplete last line of an interrupted run
+                continue
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) == 2:
+                fields += ['', '']
+            if len(fields) != 4:
+                continue
+            processedIds.add(fields[0])
+            lastRowNr = int(fields[1])
+            (outPos, questPos) = fields[2:]
+    return(processedIds, lastRowNr, outPos, questPos)
 
 # don't delete the call of main
 if __name__ == "__main__":
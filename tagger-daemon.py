@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+__author__ = "SILPAC H2"
+__version__ = "1.0"
+__email__ = "achim.stein@ling.uni-stuttgart.de"
+__license__ = "GPL"
+
+# Local tagging server for childes.py and pb1-parse-qualtrics.py
+# - listens on a Unix socket (default: see h2tools.daemonSocket(), or option --socket / $H2_TAGGER_SOCKET)
+# - keeps one warm TreeTagger process per binary + parameter file, so the parameter file is loaded only once
+# - requests arriving while the tagger is busy are sent to it together in one batch, each request
+#   followed by filler tokens, so that its context does not depend on the other requests
+# - while a request is tagged, an empty line is sent to the client every keepAlive seconds
+# - the scripts use the daemon automatically when the socket exists, and start tree-tagger themselves otherwise
+#
+# Usage:  tagger-daemon.py &        (stop with Ctrl-C or kill)
+
+import sys
+import os
+import pty
+import tty
+import time
+import queue
+import select
+import signal
+import socket
+import argparse
+import threading
+import subprocess
+import socketserver
+import concurrent.futures
+import h2tools
+
+# ----------------------------------------------------------------------
+# warm tagger processes
+# ----------------------------------------------------------------------
+class WarmTagger:
+    # a running TreeTagger process for one binary + parameter file
+    # The tagger reads stdin from a pipe and writes to a pseudo-terminal, so its output is line
+    # buffered and arrives while it keeps running. Each batch is framed by SGML marker lines
+    # (copied by -sgml) and followed by filler tokens that push the last words through the tagger.
+    # The fillers also separate the requests: every request is tagged after and before the same tokens.
+
+    def __init__(self, taggerBin, paramFile, options, args):
+        self.command = [taggerBin, paramFile] + options
+        self.flushTokens = args.flush_tokens
+        self.timeout = args.timeout
+        self.requests = queue.Queue()
+        self.batchNr = 0
+        self.process = None
+        self.pending = b''   # output read after the end marker of the last batch
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def start(self):
+        master, slave = pty.openpty()
+        tty.setraw(slave)    # no \r\n translation
+        self.process = subprocess.Popen(self.command, stdin=subprocess.PIPE, stdout=slave, stderr=subprocess.DEVNULL)
+        os.close(slave)
+        self.output = master
+        self.pending = b''
+        log("started: " + ' '.join(self.command))
+
+    def stop(self):
+        if self.process is not None:
+            self.process.kill()
+            self.process.wait()
+            os.close(self.output)
+            self.process = None
+
+    def tag(self, text):
+        # queue a request, output: future with the tagger output (bytes)
+        future = concurrent.futures.Future()
+        self.requests.put((text, future))
+        return(future)
+
+    def serve(self):
+        # take all waiting requests and tag them as one batch
+        while True:
+            batch = [self.requests.get()]
+            while True:
+                try:
+                    batch.append(self.requests.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                results = self.tagBatch([text for text, future in batch])
+            except Exception as e:
+                log("warm tagger failed (%s), running the batch with a new tagger process" % e)
+                self.stop()
+                for text, future in batch:
+                    self.tagCold(text, future)
+                continue
+            for (text, future), result in zip(batch, results):
+                future.set_result(result)
+
+    def tagCold(self, text, future):
+        # fallback: one tagger process for the request
+        try:
+            future.set_result(subprocess.run(self.command, input=text, stdout=subprocess.PIPE, check=True).stdout)
+        except Exception as e:
+            future.set_exception(e)
+
+    def tagBatch(self, texts):
+        if self.process is None or self.process.poll() is not None:
+            self.start()
+        self.batchNr += 1
+        tag = b'<h2-daemon-%d-%%d-%%s>' % self.batchNr
+        data = b''
+        for i, text in enumerate(texts):
+            if text and not text.endswith(b'\n'):
+                text += b'\n'
+            data += tag % (i, b'begin') + b'\n' + text + tag % (i, b'end') + b'\n' + b'.\n' * self.flushTokens
+        writer = threading.Thread(target=self.write, args=(data,), daemon=True)
+        writer.start()   # write while reading: the pipe and the terminal buffer are small
+        results = []
+        for i in range(len(texts)):
+            results.append(self.readUntil(tag % (i, b'begin'), tag % (i, b'end')))
+        writer.join()
+        return(results)
+
+    def write(self, data):
+        try:
+            self.process.stdin.write(data)
+            self.process.stdin.flush()
+        except (OSError, ValueError):    # tagger terminated: readUntil reports the error
+            pass
+
+    def readUntil(self, begin, end):
+        # read tagger output lines between the marker lines begin and end
+        lines = []
+        inside = False
+        deadline = time.monotonic() + self.timeout
+        while True:
+            while b'\n' in self.pending:
+                (line, self.pending) = self.pending.split(b'\n', 1)
+                line = line.rstrip(b'\r')
+                if line == begin:
+                    inside = True
+                elif line == end:
+                    return(b''.join(l + b'\n' for l in lines))
+                elif inside:
+                    lines.append(line)
+            wait = deadline - time.monotonic()
+            if wait <= 0 or not select.select([self.output], [], [], wait)[0]:
+                raise TimeoutError("no output for %.0f seconds" % self.timeout)
+            chunk = os.read(self.output, 65536)
+            if not chunk:
+                raise EOFError("tagger terminated")
+            self.pending += chunk
+            deadline = time.monotonic() + self.timeout   # the tagger is still working
+
+# ----------------------------------------------------------------------
+# server
+# ----------------------------------------------------------------------
+taggers = {}   # (binary, parameter file, options) : WarmTagger
+keepAlive = 10   # seconds between keep-alive lines (the clients give up after h2tools.daemonTimeout)
+taggersLock = threading.Lock()
+
+def log(message):
+    sys.stderr.write(time.strftime('%H:%M:%S ') + message + '\n')
+
+class Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            (header, data) = h2tools.receiveMessage(self.request)
+            key = (header['bin'], header['par'], tuple(header.get('options', [])))
+            if not os.path.exists(key[0]) or not os.path.exists(key[1]):
+                raise FileNotFoundError("tagger binary or parameter file not found: %s %s" % key[:2])
+            with taggersLock:
+                if key not in taggers:
+                    taggers[key] = WarmTagger(key[0], key[1], list(key[2]), self.server.args)
+                tagger = taggers[key]
+            future = tagger.tag(data)
+            while True:
+                try:
+                    result = future.result(timeout=keepAlive)
+                    break
+                except concurrent.futures.TimeoutError:
+                    self.request.sendall(b'\n')   # still tagging
+            h2tools.sendMessage(self.request, {}, result)
+        except Exception as e:
+            log("request failed: %s" % e)
+            try:
+                h2tools.sendMessage(self.request, {'error': str(e)}, b'')
+            except OSError:
+                pass
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Tagging daemon: keeps TreeTagger parameter files loaded for childes.py and pb1-parse-qualtrics.py.',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--socket', default=h2tools.daemonSocket(), type=str,
+        help='Unix socket (the scripts find it via $H2_TAGGER_SOCKET if it is not the default)')
+    parser.add_argument('--flush-tokens', default=20, type=int,
+        help='filler tokens sent after each request: they push its last words through the tagger and separate it from the next request')
+    parser.add_argument('--timeout', default=60, type=float,
+        help='seconds without tagger output before the batch is run with a new tagger process')
+    args = parser.parse_args()
+    if os.path.exists(args.socket):
+        try:    # is another daemon listening?
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+                s.connect(args.socket)
+            sys.stderr.write("A tagging daemon is already running on %s\n" % args.socket)
+            sys.exit(1)
+        except ConnectionRefusedError:
+            os.remove(args.socket)    # left over from a daemon that was killed
+    server = Server(args.socket, Handler)
+    server.args = args
+    os.chmod(args.socket, 0o600)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    log("tagging daemon listening on " + args.socket)
+    try:
+        server.serve_forever()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        server.server_close()
+        os.remove(args.socket)
+        for tagger in taggers.values():
+            tagger.stop()
+        log("tagging daemon stopped")
+
+if __name__ == "__main__":
+    main()